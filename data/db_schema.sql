@@ -9,6 +9,15 @@ CREATE TABLE "factoids"
     uses integer DEFAULT 0
 );
 
+CREATE TABLE "factoid_usage"
+(
+    factoid_id integer NOT NULL REFERENCES "factoids" (id) ON DELETE CASCADE,
+    "hour" timestamptz NOT NULL,
+    uses integer DEFAULT 0,
+    PRIMARY KEY (factoid_id, "hour")
+);
+CREATE INDEX ON "factoid_usage" ("hour");
+
 CREATE TABLE "hardware_stats"
 (
     id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -32,5 +41,30 @@ CREATE TABLE "filters"
     "name" text NOT NULL,
     "regex" text NOT NULL,
     "bannable" bool DEFAULT false,
-    "kickable" bool DEFAULT false
+    "kickable" bool DEFAULT false,
+    "shadow" bool DEFAULT false,
+    "channels" bigint[] DEFAULT '{}',
+    "roles" bigint[] DEFAULT '{}',
+    "matches" integer DEFAULT 0,
+    "deletes" integer DEFAULT 0,
+    "kicks" integer DEFAULT 0,
+    "bans" integer DEFAULT 0,
+    "last_match" timestamptz,
+    "eval_time" double precision DEFAULT 0,
+    "eval_max" double precision DEFAULT 0,
+    "eval_buckets" integer[] DEFAULT '{}'
+);
+
+CREATE TABLE "domain_blocklist"
+(
+    "domain" text PRIMARY KEY,
+    "punishment" text DEFAULT 'none'
+);
+
+CREATE TABLE "image_blocklist"
+(
+    id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    "name" text NOT NULL,
+    "hash" text NOT NULL,
+    "punishment" text DEFAULT 'none'
 );
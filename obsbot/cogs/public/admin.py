@@ -66,14 +66,16 @@ class Admin(Cog):
 
         # get information from other Cogs if possible
         if fac := self.bot.get_cog('Factoids'):
-            total_uses = sum(i['uses'] for i in fac.factoids.values())
+            total_uses = sum(i.uses for i in fac.store.factoids.values())
             embed.add_field(
                 name='Factoid module',
                 inline=False,
                 value=(
-                    f'Factoids:  {len(fac.factoids)}\n'
-                    f'Aliases:  {len(fac.alias_map)}\n'
-                    f'Total uses:  {total_uses} (since 2018-06-07)'
+                    f'Factoids:  {len(fac.store)}\n'
+                    f'Aliases:  {fac.store.alias_count}\n'
+                    f'Total uses:  {total_uses} (since 2018-06-07)\n'
+                    f'Reply latency:  {fac.latency.summary()}\n'
+                    f'Rate limiter:  {len(fac.limiter)} keys ({fac.limiter.evictions} expired)'
                 ),
             )
 
@@ -1,29 +1,116 @@
+import asyncio
+import heapq
+import io
 import logging
+import re
+import time
 
-from copy import deepcopy
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
+import asyncpg
 from disnake.abc import Messageable
-from disnake import Message, Embed, Member, ApplicationCommandInteraction
+from disnake import Message, Embed, File, Member, ApplicationCommandInteraction, MessageInteraction
+from disnake.enums import ButtonStyle
+from disnake.ext import tasks
 from disnake.ext.commands import Cog, command, Context, InvokableSlashCommand
+from disnake.ui.action_row import ActionRow
 
-from .utils.ratelimit import RateLimiter
+from .utils.factoid_store import Factoid, FactoidStore
+from .utils.fuzzy import TrigramIndex
+from .utils.ratelimit import RateLimiter, check_limits
+from .utils.stats import LatencyHistogram
+from .utils.templates import TemplateCache
+from .utils.text_index import InvertedIndex
+from .utils.trie import PrefixTrie
+from .utils.usage import UsageBuckets, hour_to_datetime
 
 logger = logging.getLogger(__name__)
 
+# Writes hourly rollups and bumps lifetime counters in one statement, uses of deleted factoids are dropped
+_flush_usage_query = '''
+WITH rollup AS (
+    INSERT INTO "{usage}" (factoid_id, "hour", uses)
+    SELECT u.factoid_id, u.hour, u.uses
+    FROM unnest($1::integer[], $2::timestamptz[], $3::integer[]) AS u(factoid_id, hour, uses)
+    JOIN "{factoids}" f ON f.id = u.factoid_id
+    ON CONFLICT (factoid_id, "hour") DO UPDATE SET uses = "{usage}".uses + EXCLUDED.uses
+)
+UPDATE "{factoids}" f SET uses = f.uses + t.uses
+FROM (
+    SELECT factoid_id, sum(uses) AS uses FROM unnest($1::integer[], $3::integer[]) AS u(factoid_id, uses)
+    GROUP BY factoid_id
+) t
+WHERE f.id = t.factoid_id
+'''
+_usage_since_query = '''
+SELECT f.name, sum(u.uses) AS uses FROM "{usage}" u JOIN "{factoids}" f ON f.id = u.factoid_id
+WHERE u."hour" >= $1 GROUP BY f.name
+'''
+# Bulk import/export, the CSV columns are the same in both directions
+_export_query = 'SELECT name, aliases, message, image_url, embed FROM "{factoids}" ORDER BY name'
+_import_columns = ['name', 'aliases', 'message', 'image_url', 'embed']
+_create_import_table = '''
+CREATE TEMPORARY TABLE factoid_import (name text, aliases text[], message text, image_url text, embed bool)
+ON COMMIT DROP
+'''
+_normalise_import_query = '''
+UPDATE factoid_import SET name = lower(trim(name)), embed = coalesce(embed, true),
+    aliases = coalesce((SELECT array_agg(lower(trim(a))) FROM unnest(aliases) a), '{}')
+'''
+_update_from_import_query = '''
+UPDATE "{factoids}" f SET aliases = i.aliases, message = i.message, image_url = i.image_url, embed = i.embed
+FROM factoid_import i
+WHERE f.name = i.name
+    AND (f.aliases, f.message, f.image_url, f.embed) IS DISTINCT FROM (i.aliases, i.message, i.image_url, i.embed)
+'''
+_insert_from_import_query = '''
+INSERT INTO "{factoids}" (name, aliases, message, image_url, embed)
+SELECT name, aliases, message, image_url, embed FROM factoid_import i
+WHERE NOT EXISTS (SELECT 1 FROM "{factoids}" f WHERE f.name = i.name)
+'''
+_period_re = re.compile(r'^(\d+)([hdw])$')
+_period_units = dict(h='hours', d='days', w='weeks')
+
 
 class Factoids(Cog):
     _factoids_colour = 0x36393E
     _log_colour = 0xFFB400
+    # Discord's limit for autocomplete choices
+    _max_choices = 25
 
     def __init__(self, bot, config):
         self.bot = bot
-        self.alias_map = dict()
-        self.factoids = dict()
+        # immutable snapshot, only ever replaced as a whole
+        self.store = FactoidStore()
+        # held from writing a factoid to the DB until the change is applied to the snapshot, and by reconciliation
+        # from its query until the swap, so that it can't replace the snapshot with one that misses a change
+        self._write_lock = asyncio.Lock()
         self.config = config
-        self.limiter = RateLimiter(self.config.get('cooldown', 20.0))
+        self.limiter = RateLimiter(self.config.get('cooldown', 20.0), burst=self.config.get('burst', 1))
+        # limits all factoid replies to non-supporters, e.g. during raids
+        self.global_limiter = RateLimiter(self.config.get('global_cooldown', 1.0), self.config.get('global_burst', 10))
+        # ready-to-send (rendered message, content, embed) per factoid
+        self._payloads = dict()
+        self.latency = LatencyHistogram()
+        # fuzzy index over factoid names and aliases for "did you mean" suggestions
+        self.name_index = TrigramIndex()
+        # prefix trie over factoid names and aliases for slash command autocompletion
+        self.name_trie = PrefixTrie()
+        self.suggestion_limiter = RateLimiter(self.config.get('suggestion_cooldown', 60.0))
+        # full-text index over factoid names, aliases and messages
+        self.search_index = InvertedIndex()
+        # channels in which questions are matched against factoids (opt-in via .togglesuggestions)
+        self.suggestion_channels = set(self.bot.state.get('factoid_suggestion_channels', []))
+        self.suggestion_threshold = self.config.get('suggestion_threshold', 0.4)
+        # (author id, file contents) of the last import dry-run, waiting to be applied
+        self._pending_import = None
+        # hourly usage buckets, flushed to the DB in batches
+        self.usage = UsageBuckets()
+        self.usage_table = self.config.get('usage_table', 'factoid_usage')
+        self.add_slash_commands()
 
-        self.initial_commands_sync_done = False
         self.log_channel: Optional[Messageable] = None
 
         # The variables map to state variables, can be added at runtime
@@ -36,6 +123,16 @@ class Factoids(Cog):
         if 'factoid_variables' in self.bot.state:
             self.variables.update(self.bot.state['factoid_variables'])
 
+        # compiled factoid messages, rendered output is invalidated when a variable it uses changes
+        self.templates = TemplateCache(self.bot.state, self.variables, self._resolve_name)
+        self.bot.state.add_listener(self.templates.on_state_change)
+
+        if intv := self.config.get('reconcile_interval'):
+            logger.info(f'Changing factoid reconciliation interval to {intv} seconds')
+            self.reconcile.change_interval(seconds=intv)
+        if intv := self.config.get('usage_flush_interval'):
+            self.usage_flusher.change_interval(seconds=intv)
+
         if admin := self.bot.get_cog('Admin'):
             admin.add_help_section(
                 'Factoids',
@@ -49,70 +146,204 @@ class Factoids(Cog):
                     ('.setembed <name> [y/n]', 'Set/toggle embed status'),
                     ('.setimgurl <name> [url]', 'set image url (empty to clear)'),
                     ('.info <name>', 'Print factoid info'),
-                    ('.top', 'Print most used commands'),
-                    ('.bottom', 'Print least used commands'),
-                    ('.unused', 'Print unused commands'),
+                    ('.top [period]', 'Print most used commands (optionally within period, e.g. 7d)'),
+                    ('.bottom [period]', 'Print least used commands'),
+                    ('.unused [period]', 'Print unused commands'),
+                    ('.search <terms>', 'Search factoids by content'),
+                    ('.exportfactoids', 'Export all factoids as CSV'),
+                    ('.importfactoids [apply]', 'Dry-run import of attached CSV, then apply it'),
+                    ('.togglesuggestions', 'Enable/Disable factoid suggestions for questions in this channel'),
                 ],
             )
 
+    def add_slash_commands(self):
+        # a single /factoid command with autocomplete covers all factoids, so no re-syncing is ever required
+        factoid_command = InvokableSlashCommand(
+            self.slash_factoid,
+            name='factoid',
+            description='Sends a factoid',
+            guild_ids=[self.bot.config['bot']['main_guild']],
+        )
+
+        # disnake needs to set attributes on the autocompleter, which is not possible with bound methods
+        async def autocomplete(_inter: ApplicationCommandInteraction, string: str):
+            return self.complete_factoid(string)
+
+        factoid_command.autocomplete('name')(autocomplete)
+        self.bot.add_slash_command(factoid_command)
+        self.bot.add_slash_command(
+            InvokableSlashCommand(
+                self.slash_search,
+                name='search',
+                description='Search factoids',
+                guild_ids=[self.bot.config['bot']['main_guild']],
+            )
+        )
+
+    def _resolve_name(self, name):
+        factoid = self.store.get(name)
+        return factoid.name if factoid else None
+
+    def _apply_factoid(self, factoid: Factoid, old_name=None):
+        """Swap in a snapshot with a single new or updated factoid and update derived indexes"""
+        old = self.store.get(old_name or factoid.name)
+        self.store = self.store.replace(old_name or factoid.name, factoid)
+        self._update_indexes(old, factoid)
+
+    def _drop_factoid(self, name) -> Optional[Factoid]:
+        """Swap in a snapshot without factoid `name`, returns the removed factoid (if any)"""
+        if factoid := self.store.factoids.get(name):
+            self.store = self.store.replace(name)
+            self._update_indexes(factoid, None)
+        return factoid
+
+    def _update_indexes(self, old: Optional[Factoid], new: Optional[Factoid]):
+        if old:
+            for name in old.names:
+                self.name_index.remove(name)
+                self.name_trie.remove(name)
+            self.search_index.remove(old.name)
+            self._payloads.pop(old.name, None)
+            self.templates.remove(old.name)
+        if new:
+            for name in new.names:
+                self.name_index.add(name)
+                self.name_trie.add(name)
+            self.search_index.add(new.name, self._search_text(new))
+            # at edit time rather than lazily in similar(), which runs for messages
+            self.search_index.refresh_stale_vectors()
+            self._payloads.pop(new.name, None)
+            self.templates.set(new.name, new.message, new.names)
+
+    @staticmethod
+    def _search_text(factoid: Factoid):
+        return ' '.join(factoid.names + (factoid.message,))
+
+    def _check_template(self, name, message, names):
+        """Returns error message if the factoid message would result in a circular reference"""
+        try:
+            self.templates.check(name, message, names)
+        except ValueError as e:
+            return f'Factoid message is invalid: {e}'
+
+    async def _update_factoid(self, factoid_name, **values) -> Optional[Factoid]:
+        """Update columns of a factoid in the DB and apply the returned row as a delta"""
+        columns = ', '.join(f'"{column}"=${i}' for i, column in enumerate(values, start=2))
+        async with self._write_lock:
+            record = await self.bot.db.query_row(
+                f'UPDATE "{self.config["db_table"]}" SET {columns} WHERE name=$1 RETURNING *',
+                factoid_name,
+                *values.values(),
+            )
+            if not record:  # row has disappeared from under us, the next reconciliation will sort out the rest
+                logger.warning(f'Updating factoid "{factoid_name}" did not return a row!')
+                self._drop_factoid(factoid_name)
+                return None
+
+            factoid = Factoid.from_record(record)
+            self._apply_factoid(factoid, old_name=factoid_name)
+        return factoid
+
     async def fetch_factoids(self, refresh=False):
+        async with self._write_lock:
+            await self._fetch_factoids(refresh)
+
+    async def _fetch_factoids(self, refresh=False):
         rows = await self.bot.db.query(f'SELECT * FROM "{self.config["db_table"]}"')
         if not rows:
             logger.warning('No factoids in database!')
             return
         elif not refresh:
             logger.info(f'Received {len(rows)} factoid entries from database.')
-        else:
-            # clear existing factoid information
-            self.factoids = dict()
-            self.alias_map = dict()
-
-        for record in rows:
-            name = record['name']
-            factoid = dict(
-                name=name,
-                uses=record['uses'],
-                embed=record['embed'],
-                message=record['message'],
-                image_url=record['image_url'],
-                aliases=record['aliases'],
-            )
-            self.factoids[name] = factoid
-            for alias in record['aliases']:
-                self.alias_map[alias] = name
 
-        # Get top N commands, register new and unregister old ones
+        # build the new snapshot and indexes off to the side, then swap them in
+        store = FactoidStore(Factoid.from_record(record) for record in rows)
+        name_index = TrigramIndex(store.lookup)
+        search_index = InvertedIndex()
+        for name, factoid in store.factoids.items():
+            search_index.add(name, self._search_text(factoid))
+        search_index.refresh_vectors()
+
+        if refresh:
+            # usage counts are updated asynchronously and may be slightly off, so ignore them here
+            drifted = [
+                name
+                for name in store.factoids.keys() | self.store.factoids.keys()
+                if name not in store.factoids or not store.factoids[name].same_content(self.store.factoids.get(name))
+            ]
+            if drifted:
+                logger.warning(f'Reconciliation found {len(drifted)} drifted factoid(s): {", ".join(sorted(drifted))}')
+
+        self.store = store
+        self.name_index = name_index
+        self.name_trie = PrefixTrie(store.lookup)
+        self.search_index = search_index
+        self._payloads = dict()
+        self.templates.load({name: (f.message, f.names) for name, f in store.factoids.items()})
+
+    @tasks.loop(hours=1.0)
+    async def reconcile(self):
+        # first iteration does the initial load, later ones catch drift between memory and DB
+        try:
+            if self.reconcile.current_loop == 0:
+                await self.fetch_usage()
+            else:  # make sure lifetime usage counts in the DB are current
+                await self.flush_usage()
+            await self.fetch_factoids(refresh=self.reconcile.current_loop > 0)
+        except Exception as e:
+            # the loop stops for good on an exception, try again next time
+            logger.error(f'Reconciling factoids failed: {e!r}')
+
+    async def fetch_usage(self):
+        """Load hourly usage rollups of the in-memory window"""
         rows = await self.bot.db.query(
-            f'SELECT "name" FROM "{self.config["db_table"]}" '
-            f'ORDER BY "uses" DESC LIMIT {self.config["slash_command_limit"]}'
+            f'SELECT factoid_id, "hour", uses FROM "{self.usage_table}" WHERE "hour" >= $1',
+            hour_to_datetime(self.usage.current_hour() - self.usage.window_hours),
         )
-        # some simple set maths to get new/old/current commands
-        commands = set(r['name'] for r in rows)
-        old_commands = set(c.name for c in self.bot.slash_commands)
-        new_commands = commands - old_commands
-        old_commands -= commands
-
-        for factoid in new_commands:
-            logger.info(f'Adding slash command for "{factoid}"')
-            self.bot.add_slash_command(
-                InvokableSlashCommand(
-                    self.slash_factoid,
-                    name=factoid,
-                    description=f'Sends "{factoid}" factoid',
-                    guild_ids=[self.bot.config['bot']['main_guild']],
-                )
-            )
+        self.usage.load((r['factoid_id'], int(r['hour'].timestamp() // 3600), r['uses']) for r in rows)
+        logger.info(f'Received {len(rows)} factoid usage rollups from database.')
 
-        # Delete commands that are now obsolete
-        for obsolete in old_commands:
-            logger.info(f'Removing slash command "{obsolete}"')
-            self.bot.remove_slash_command(obsolete)
+    async def flush_usage(self):
+        if not (pending := self.usage.take_pending()):
+            return
 
-        # sync commands with discord API (only run if commands have already been registered)
-        if new_commands or new_commands or not self.initial_commands_sync_done:
-            self.bot._schedule_delayed_command_sync()
+        ids, hours, uses = [], [], []
+        for (factoid_id, hour), count in pending.items():
+            ids.append(factoid_id)
+            hours.append(hour_to_datetime(hour))
+            uses.append(count)
 
-        self.initial_commands_sync_done = True
+        try:
+            await self.bot.db.exec(
+                _flush_usage_query.format(usage=self.usage_table, factoids=self.config['db_table']), ids, hours, uses
+            )
+        except Exception as e:
+            logger.error(f'Flushing factoid usage failed: {e!r}')
+            self.usage.restore(pending)
+
+    @tasks.loop(seconds=5.0)
+    async def usage_flusher(self):
+        await self.flush_usage()
+
+    async def _get_uses(self, period=None):
+        """Returns dict of factoid name -> uses, either lifetime or within `period` (e.g. "7d")"""
+        if not period:
+            return {name: factoid.uses for name, factoid in self.store.factoids.items()}
+        try:
+            if not (m := _period_re.match(period.lower())):
+                raise ValueError
+            since = datetime.now(timezone.utc) - timedelta(**{_period_units[m.group(2)]: int(m.group(1))})
+        except (ValueError, OverflowError):
+            # periods too long for timedelta/datetime overflow
+            raise ValueError(f'Invalid period "{period}" (examples: 24h, 7d, 4w)')
+
+        await self.flush_usage()
+        rows = await self.bot.db.query(
+            _usage_since_query.format(usage=self.usage_table, factoids=self.config['db_table']), since
+        )
+        uses = dict.fromkeys(self.store.factoids, 0)
+        uses.update((r['name'], r['uses']) for r in rows if r['name'] in uses)
+        return uses
 
     async def init_logging(self):
         if 'log_channel' not in self.config:
@@ -122,7 +353,7 @@ class Factoids(Cog):
         if self.log_channel:
             logger.info(f'Found factoid changelog channel: {self.log_channel}')
 
-    async def _log_action(self, actor: Member, new: dict = None, old: dict = None):
+    async def _log_action(self, actor: Member, new: Factoid = None, old: Factoid = None):
         if not self.log_channel:
             return
         if not old and not new:
@@ -131,52 +362,52 @@ class Factoids(Cog):
         # New factoid created
         if new and not old:
             embed = Embed(
-                title=f'Factoid `{new["name"]}` was created',
+                title=f'Factoid `{new.name}` was created',
                 description=f'**User:** {actor.mention}',
                 colour=self._log_colour,
             )
-            embed.add_field('Message', f'```\n{new["message"]}\n```')
+            embed.add_field('Message', f'```\n{new.message}\n```')
             return await self.log_channel.send(embed=embed)
 
         # Factoid deleted
         if old and not new:
             embed = Embed(
-                title=f'Factoid `{old["name"]}` was deleted',
+                title=f'Factoid `{old.name}` was deleted',
                 description=f'**User:** {actor.mention}',
                 colour=self._log_colour,
             )
 
-            embed.add_field('Message', f'```\n{old["message"]}\n```', inline=False)
-            if old['image_url']:
-                embed.add_field('Image URL', old['image_url'], inline=False)
-            if old['aliases']:
+            embed.add_field('Message', f'```\n{old.message}\n```', inline=False)
+            if old.image_url:
+                embed.add_field('Image URL', old.image_url, inline=False)
+            if old.aliases:
                 embed.add_field(
-                    'Aliases', '`{}`'.format(', '.join(old['aliases']) if old['aliases'] else '<Empty>'), inline=False
+                    'Aliases', '`{}`'.format(', '.join(old.aliases) if old.aliases else '<Empty>'), inline=False
                 )
-            embed.add_field('Uses', old['uses'], inline=False)
+            embed.add_field('Uses', old.uses, inline=False)
             return await self.log_channel.send(embed=embed)
 
         # Factoid modified
         embed = Embed(
-            title=f'Factoid `{old["name"]}` was updated',
+            title=f'Factoid `{old.name}` was updated',
             description=f'**User:** {actor.mention}',
             colour=self._log_colour,
         )
 
-        if old['message'] != new['message']:
-            embed.add_field('Old message', f'```\n{old["message"]}\n```', inline=False)
-            embed.add_field('New message', f'```\n{new["message"]}\n```', inline=False)
+        if old.message != new.message:
+            embed.add_field('Old message', f'```\n{old.message}\n```', inline=False)
+            embed.add_field('New message', f'```\n{new.message}\n```', inline=False)
 
-        if old['image_url'] != new['image_url']:
-            embed.add_field('Old Image URL', old['image_url'], inline=False)
-            embed.add_field('New Image URL', new['image_url'], inline=False)
+        if old.image_url != new.image_url:
+            embed.add_field('Old Image URL', old.image_url, inline=False)
+            embed.add_field('New Image URL', new.image_url, inline=False)
 
-        if old['aliases'] != new['aliases']:
+        if old.aliases != new.aliases:
             embed.add_field(
-                'Old Aliases', '`{}`'.format(', '.join(old['aliases']) if old['aliases'] else '<Empty>'), inline=False
+                'Old Aliases', '`{}`'.format(', '.join(old.aliases) if old.aliases else '<Empty>'), inline=False
             )
             embed.add_field(
-                'New Aliases', '`{}`'.format(', '.join(new['aliases']) if new['aliases'] else '<Empty>'), inline=False
+                'New Aliases', '`{}`'.format(', '.join(new.aliases) if new.aliases else '<Empty>'), inline=False
             )
 
         # If no loggable changes were made, ignore it
@@ -188,68 +419,112 @@ class Factoids(Cog):
     def set_variable(self, variable, value):
         self.variables[variable] = value
         self.bot.state['factoid_variables'] = self.variables.copy()
+        self.templates.recompile()
+
+    def _get_payload(self, name):
+        """Returns (content, embed) ready to be sent, only rebuilt if the factoid or its rendered message changed"""
+        message = self.templates.render(name)
+        payload = self._payloads.get(name)
+        if payload is None or payload[0] != message:
+            factoid = self.store.factoids[name]
+            content = message
+            embed = None
+            if factoid.embed:
+                embed = Embed(colour=self._factoids_colour, description=message)
+                content = ''
+                if factoid.image_url:
+                    embed.set_image(url=factoid.image_url)
+            payload = self._payloads[name] = (message, content, embed)
+        return payload[1], payload[2]
+
+    async def _run_concurrently(self, start, *coros):
+        """Run reply and its side effects concurrently, then record the request's latency"""
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        self.latency.record(time.perf_counter() - start)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f'Factoid request action failed with {result!r}')
+
+    def is_limited(self, factoid_name, channel_id, author_id):
+        """Per channel, per user and global quotas are checked together, none is used up if any of them is limited"""
+        return check_limits(
+            (self.limiter, (factoid_name, channel_id)),
+            (self.limiter, (factoid_name, author_id)),
+            (self.global_limiter, ()),
+        )
 
-    def resolve_variables(self, factoid_message):
-        if '%' not in factoid_message:
-            return factoid_message
-
-        for variable, state_variable in self.variables.items():
-            value = self.bot.state.get(state_variable, 'https://obsproject.com/4oh4')
-            factoid_message = factoid_message.replace(variable, value)
-        return factoid_message
-
-    async def slash_factoid(self, ctx: ApplicationCommandInteraction, mention: Member = None):
-        if not self.bot.is_supporter(ctx.author) and (
-            self.limiter.is_limited(ctx.data.id, ctx.channel_id) or self.limiter.is_limited(ctx.data.id, ctx.author.id)
-        ):
-            logger.debug(f'rate-limited (sc): "{ctx.author}", channel: "{ctx.channel}", factoid: "{ctx.data.name}"')
-            return
-
-        logger.info(f'factoid requested (sc) by: "{ctx.author}", channel: "{ctx.channel}", factoid: "{ctx.data.name}"')
-        await self.increment_uses(ctx.data.name)
-        message = self.resolve_variables(self.factoids[ctx.data.name]['message'])
-
-        embed = None
-        if self.factoids[ctx.data.name]['embed']:
-            embed = Embed(colour=self._factoids_colour, description=message)
-            message = ''
-            if self.factoids[ctx.data.name]['image_url']:
-                embed.set_image(url=self.factoids[ctx.data.name]['image_url'])
-
+    def complete_factoid(self, prefix):
+        """Returns factoid names/aliases starting with prefix, most used in the last week first"""
+        prefix = prefix.strip().lower()
+        # only suggest one name per factoid, preferring the actual name over aliases
+        matches = dict()
+        for key in self.name_trie.iter_prefix(prefix):
+            if (factoid := self.store.get(key)) and (factoid.name not in matches or key == factoid.name):
+                matches[factoid.name] = key
+        if not matches:
+            return self.name_index.search(prefix, limit=self._max_choices)
+
+        def weight(item):
+            factoid = self.store.factoids[item[0]]
+            return self.usage.recent(factoid.id), factoid.uses
+
+        return [key for _, key in heapq.nlargest(self._max_choices, matches.items(), key=weight)]
+
+    async def slash_factoid(self, ctx: ApplicationCommandInteraction, name: str, mention: Member = None):
+        """
+        Sends a factoid
+
+        Parameters
+        ----------
+        name: Name of the factoid
+        mention: User to mention in the reply
+        """
+        start = time.perf_counter()
+        if not (factoid := self.store.get(name.strip().lower())):
+            return await ctx.send(f'The specified factoid ("{name}") does not exist!', ephemeral=True)
+
+        if not self.bot.is_supporter(ctx.author) and self.is_limited(factoid.name, ctx.channel_id, ctx.author.id):
+            logger.debug(f'rate-limited (sc): "{ctx.author}", channel: "{ctx.channel}", factoid: "{factoid.name}"')
+            return await ctx.send('This factoid has been sent recently, please try again later.', ephemeral=True)
+
+        logger.info(f'factoid requested (sc) by: "{ctx.author}", channel: "{ctx.channel}", factoid: "{factoid.name}"')
+        content, embed = self._get_payload(factoid.name)
         if mention and isinstance(mention, Member):
-            return await ctx.send(content=f'{mention.mention} {message}', embed=embed)
-        else:
-            return await ctx.send(content=message, embed=embed)
+            content = f'{mention.mention} {content}'
+
+        self.increment_uses(factoid.name)
+        await self._run_concurrently(start, ctx.send(content=content, embed=embed))
 
     @Cog.listener()
     async def on_filtered_message(self, msg: Message):
-        if not msg.content or len(msg.content) < 2 or msg.content[0] != '!':
+        if not msg.content or len(msg.content) < 2:
+            return
+        if msg.content[0] != '!':
+            if msg.channel.id in self.suggestion_channels:
+                await self.suggest_answer(msg)
+            return
+        start = time.perf_counter()
+        if not (msg_parts := msg.content[1:].split()):
             return
-        msg_parts = msg.content[1:].split()
 
         factoid_name = msg_parts[0].lower()
 
-        if factoid_name not in self.factoids:
-            if factoid_name in self.alias_map:
-                factoid_name = self.alias_map[factoid_name]
-            else:  # factoid does not exit
-                return
+        if not (factoid := self.store.get(factoid_name)):  # factoid does not exist
+            return await self.suggest_factoids(msg, factoid_name)
+        factoid_name = factoid.name
 
-        if not self.bot.is_supporter(msg.author) and (
-            self.limiter.is_limited(factoid_name, msg.channel.id)
-            or self.limiter.is_limited(factoid_name, msg.author.id)
-        ):
+        if not self.bot.is_supporter(msg.author) and self.is_limited(factoid_name, msg.channel.id, msg.author.id):
             logger.debug(f'rate-limited: "{msg.author}", channel: "{msg.channel}", factoid: "{factoid_name}"')
             return
 
         logger.info(f'factoid requested by: "{msg.author}", channel: "{msg.channel}", factoid: "{factoid_name}"')
-        factoid = self.factoids[factoid_name]
-        await self.increment_uses(factoid_name)
-        message = self.resolve_variables(factoid['message'])
+        content, embed = self._get_payload(factoid_name)
+        self.increment_uses(factoid_name)
+        actions = []
 
         # attempt to delete the message requesting the factoid if it's within a reply and only contains command
         if msg.reference and len(msg_parts) == 1:
-            await msg.delete(delay=0.0)
+            actions.append(msg.delete())
 
         # if users are mentioned (but it's not a reply), mention them in the bot reply as well
         user_mention = None
@@ -259,77 +534,142 @@ class Factoids(Cog):
             else:
                 user_mention = msg.mentions[0].mention
 
-        embed = None
-        if factoid['embed']:
-            embed = Embed(colour=self._factoids_colour, description=message)
-            message = ''
-            if factoid['image_url']:
-                embed.set_image(url=factoid['image_url'])
-
         if user_mention and embed is not None:
-            return await msg.channel.send(user_mention, embed=embed)
+            actions.append(msg.channel.send(user_mention, embed=embed))
         elif user_mention:
-            return await msg.channel.send(f'{user_mention} {message}')
+            actions.append(msg.channel.send(f'{user_mention} {content}'))
         else:
             msg_reference = msg.reference
             # If reference is a message from a bot, try resolving the referenced message's reference
             if msg_reference and msg.reference.resolved.author.bot and (ref := msg.reference.resolved.reference):
                 msg_reference = ref
 
-            return await msg.channel.send(
-                message, embed=embed, reference=msg_reference, mention_author=True  # type: ignore
+            actions.append(
+                msg.channel.send(content, embed=embed, reference=msg_reference, mention_author=True)  # type: ignore
             )
 
-    async def increment_uses(self, factoid_name):
-        return await self.bot.db.add_task(
-            f'''UPDATE "{self.config["db_table"]}" SET uses=uses+1 WHERE name=$1''', factoid_name
+        await self._run_concurrently(start, *actions)
+
+    async def suggest_factoids(self, msg: Message, name):
+        if not self.config.get('fuzzy_suggestions', True) or len(name) < 3:
+            return
+        if not (suggestions := self.name_index.search(name, max_distance=min(2, len(name) // 3))):
+            return
+        if check_limits((self.suggestion_limiter, (msg.channel.id,)), (self.suggestion_limiter, (msg.author.id,))):
+            logger.debug(f'rate-limited suggestion: "{msg.author}", channel: "{msg.channel}", factoid: "{name}"')
+            return
+
+        suggestions = ', '.join(f'`!{suggestion}`' for suggestion in suggestions)
+        await msg.channel.send(f'Unknown factoid, did you mean {suggestions}?', reference=msg, mention_author=False)
+
+    async def suggest_answer(self, msg: Message):
+        """Offer the factoid that best matches a (presumed) question, if it is similar enough"""
+        if msg.author.bot or self.bot.is_supporter(msg.author):
+            return
+        # only consider the start of long messages to keep scoring time bounded
+        if not (matches := self.search_index.similar(msg.content[:500])):
+            return
+        name, score = matches[0]
+        if score < self.suggestion_threshold:
+            return
+        if check_limits((self.suggestion_limiter, (name, msg.channel.id)), (self.suggestion_limiter, (msg.author.id,))):
+            return
+
+        if not (factoid := self.store.get(name)):
+            return
+
+        logger.info(f'Suggesting "{name}" (score: {score:.2f}) to "{msg.author}", channel: "{msg.channel}"')
+        row = ActionRow()
+        # custom IDs are limited to 100 characters and labels to 80, names can be longer
+        label = f'Show !{name}'
+        row.add_button(
+            label=label if len(label) <= 80 else label[:79] + '…',
+            style=ButtonStyle.primary,
+            custom_id=f'factoid_suggestion_{msg.author.id}_{factoid.id}',
+        )
+        row.add_button(label='Dismiss', style=ButtonStyle.secondary, custom_id=f'factoid_dismiss_{msg.author.id}')
+        await msg.channel.send(
+            f'This factoid might help: `!{name}`', components=row, reference=msg, mention_author=False
         )
 
+    @Cog.listener()
+    async def on_button_click(self, interaction: MessageInteraction):
+        if not interaction.data.custom_id.startswith(('factoid_suggestion_', 'factoid_dismiss_')):
+            return
+        _, action, author_id, *key = interaction.data.custom_id.split('_', 3)
+        if interaction.author.id != int(author_id) and not self.bot.is_supporter(interaction.author):
+            return await interaction.response.send_message('You do not have permission to use this.', ephemeral=True)
+
+        if action == 'dismiss':
+            await interaction.response.defer()
+            return await interaction.message.delete()
+        if not (factoid := self.store.get_by_id(int(key[0]))):
+            return await interaction.response.edit_message(content='This factoid no longer exists.', components=None)
+
+        start = time.perf_counter()
+        logger.info(f'factoid suggestion accepted by: "{interaction.author}", factoid: "{factoid.name}"')
+        content, embed = self._get_payload(factoid.name)
+        self.increment_uses(factoid.name)
+        await self._run_concurrently(
+            start, interaction.response.edit_message(content=content, embed=embed, components=None)
+        )
+
+    def increment_uses(self, factoid_name):
+        factoid = self.store.factoids[factoid_name]
+        factoid.uses += 1
+        self.usage.record(factoid.id)
+
     @command()
     async def add(self, ctx: Context, name: str.lower, *, message):
         if not self.bot.is_admin(ctx.author):
             return
-        if name in self.factoids or name in self.alias_map:
+        if name in self.store:
             return await ctx.send(f'The specified name ("{name}") already exists as factoid or alias!')
-
-        await self.bot.db.exec(
-            f'''INSERT INTO "{self.config["db_table"]}" (name, message) VALUES ($1, $2)''', name, message
-        )
-        await self.fetch_factoids(refresh=True)
+        if error := self._check_template(name, message, [name]):
+            return await ctx.send(error)
+
+        async with self._write_lock:
+            record = await self.bot.db.query_row(
+                f'''INSERT INTO "{self.config["db_table"]}" (name, message) VALUES ($1, $2) RETURNING *''',
+                name,
+                message,
+            )
+            factoid = Factoid.from_record(record)
+            self._apply_factoid(factoid)
         await ctx.send(f'Factoid "{name}" has been added.')
-        await self._log_action(ctx.author, new=self.factoids[name])
+        await self._log_action(ctx.author, new=factoid)
 
     @command()
     async def mod(self, ctx: Context, name: str.lower, *, message):
         if not self.bot.is_admin(ctx.author):
             return
-        _name = name if name in self.factoids else self.alias_map.get(name)
-        if not _name or _name not in self.factoids:
+        if not (old_factoid := self.store.get(name)):
             return await ctx.send(f'The specified name ("{name}") does not exist!')
 
         # allow clearing message of embeds
-        if self.factoids[_name]['embed'] and message == '""':
+        if old_factoid.embed and message == '""':
             message = ''
 
-        old_factoid = self.factoids[_name].copy()
-        await self.bot.db.exec(f'''UPDATE "{self.config["db_table"]}" SET message=$2 WHERE name=$1''', _name, message)
+        if error := self._check_template(old_factoid.name, message, old_factoid.names):
+            return await ctx.send(error)
+        if not (factoid := await self._update_factoid(old_factoid.name, message=message)):
+            return await ctx.send(f'The specified name ("{name}") does not exist!')
 
-        await self.fetch_factoids(refresh=True)
         await ctx.send(f'Factoid "{name}" has been updated.')
-        await self._log_action(ctx.author, new=self.factoids[_name], old=old_factoid)
+        await self._log_action(ctx.author, new=factoid, old=old_factoid)
 
     @command(name='del')
     async def _del(self, ctx: Context, name: str.lower):
         if not self.bot.is_admin(ctx.author):
             return
-        if name not in self.factoids:
+        if name not in self.store.factoids:
             return await ctx.send(
                 f'The specified factoid name ("{name}") does not exist ' f'(use base name instead of alias)!'
             )
 
-        factoid = self.factoids[name].copy()
-        await self.bot.db.exec(f'''DELETE FROM "{self.config["db_table"]}" WHERE name=$1''', name)
-        await self.fetch_factoids(refresh=True)
+        async with self._write_lock:
+            await self.bot.db.exec(f'''DELETE FROM "{self.config["db_table"]}" WHERE name=$1''', name)
+            factoid = self._drop_factoid(name)
         await ctx.send(f'Factoid "{name}" has been deleted.')
         await self._log_action(ctx.author, old=factoid)
 
@@ -337,161 +677,303 @@ class Factoids(Cog):
     async def ren(self, ctx: Context, name: str.lower, new_name: str.lower):
         if not self.bot.is_admin(ctx.author):
             return
-        if name not in self.factoids and name not in self.alias_map:
+        if not (factoid := self.store.get(name)):
             return await ctx.send(f'The specified name ("{name}") does not exist!')
-        if new_name in self.factoids or new_name in self.alias_map:
+        if new_name in self.store:
             return await ctx.send(f'The specified new name ("{name}") already exist as factoid or alias!')
 
         # ToDo log renaming
         # if name is an alias, rename the alias instead
-        if name in self.alias_map:
-            real_name = self.alias_map[name]
+        if name != factoid.name:
+            real_name = factoid.name
             # get list of aliases minus the old one, then append the new one
-            aliases = [i for i in self.factoids[real_name]['aliases'] if i != name]
+            aliases = [i for i in factoid.aliases if i != name]
             aliases.append(new_name)
+            if error := self._check_template(real_name, factoid.message, [real_name] + aliases):
+                return await ctx.send(error)
 
-            await self.bot.db.exec(
-                f'''UPDATE "{self.config["db_table"]}" SET aliases=$2 WHERE name=$1''', real_name, aliases
-            )
-
-            await self.fetch_factoids(refresh=True)
+            await self._update_factoid(real_name, aliases=aliases)
             return await ctx.send(f'Alias "{name}" for "{real_name}" has been renamed to "{new_name}".')
         else:
-            await self.bot.db.exec(f'''UPDATE "{self.config["db_table"]}" SET name=$2 WHERE name=$1''', name, new_name)
+            if error := self._check_template(name, factoid.message, (new_name,) + factoid.aliases):
+                return await ctx.send(error)
 
-            await self.fetch_factoids(refresh=True)
+            await self._update_factoid(name, name=new_name)
             return await ctx.send(f'Factoid "{name}" has been renamed to "{new_name}".')
 
     @command()
     async def addalias(self, ctx: Context, alias: str.lower, name: str.lower):
         if not self.bot.is_admin(ctx.author):
             return
-        _name = name if name in self.factoids else self.alias_map.get(name)
-        if not _name or _name not in self.factoids:
+        if not (old_factoid := self.store.get(name)):
             return await ctx.send(f'The specified factoid ("{name}") does not exist!')
-        if alias in self.factoids:
+        if alias in self.store.factoids:
             return await ctx.send(f'The specified alias ("{alias}") is the name of an existing factoid!')
-        if alias in self.alias_map:
+        if alias in self.store:
             return await ctx.send(f'The specified alias ("{alias}") already exists!')
 
-        old_factoid = deepcopy(self.factoids[_name])
-        self.factoids[_name]['aliases'].append(alias)
+        aliases = list(old_factoid.aliases) + [alias]
+        if error := self._check_template(old_factoid.name, old_factoid.message, [old_factoid.name] + aliases):
+            return await ctx.send(error)
 
-        await self.bot.db.exec(
-            f'''UPDATE "{self.config["db_table"]}" SET aliases=$2 WHERE name=$1''',
-            _name,
-            self.factoids[_name]['aliases'],
-        )
-
-        await self.fetch_factoids(refresh=True)
+        factoid = await self._update_factoid(old_factoid.name, aliases=aliases)
         await ctx.send(f'Alias "{alias}" added to "{name}".')
-        await self._log_action(ctx.author, new=self.factoids[_name], old=old_factoid)
+        await self._log_action(ctx.author, new=factoid, old=old_factoid)
 
     @command()
     async def delalias(self, ctx: Context, alias: str.lower):
         if not self.bot.is_admin(ctx.author):
             return
-        if alias not in self.alias_map:
+        if alias in self.store.factoids or not (old_factoid := self.store.get(alias)):
             return await ctx.send(f'The specified name ("{alias}") does not exist!')
 
-        real_name = self.alias_map[alias]
-        old_factoid = deepcopy(self.factoids[real_name])
-        # get list of aliases minus the old one, then append the new one
-        aliases = [i for i in self.factoids[real_name]['aliases'] if i != alias]
-
-        await self.bot.db.exec(
-            f'''UPDATE "{self.config["db_table"]}" SET aliases=$2 WHERE name=$1''', real_name, aliases
-        )
+        real_name = old_factoid.name
+        # get list of aliases minus the old one
+        aliases = [i for i in old_factoid.aliases if i != alias]
 
-        await self.fetch_factoids(refresh=True)
+        factoid = await self._update_factoid(real_name, aliases=aliases)
         await ctx.send(f'Alias "{alias}" for "{real_name}" has been removed.')
-        await self._log_action(ctx.author, new=self.factoids[real_name], old=old_factoid)
+        await self._log_action(ctx.author, new=factoid, old=old_factoid)
 
     @command()
     async def setembed(self, ctx: Context, name: str.lower, yesno: bool = None):
         if not self.bot.is_admin(ctx.author):
             return
-        _name = name if name in self.factoids else self.alias_map.get(name)
-        if not _name or _name not in self.factoids:
+        if not (factoid := self.store.get(name)):
             return await ctx.send(f'The specified factoid ("{name}") does not exist!')
 
-        factoid = self.factoids[_name]
-        embed_status = factoid['embed']
+        embed_status = factoid.embed
 
         if yesno is None:
             embed_status = not embed_status
         else:
             embed_status = yesno
 
-        await self.bot.db.exec(
-            f'''UPDATE "{self.config["db_table"]}" SET embed=$2 WHERE name=$1''', _name, embed_status
-        )
-
-        await self.fetch_factoids(refresh=True)
+        await self._update_factoid(factoid.name, embed=embed_status)
         return await ctx.send(f'Embed mode for "{name}" set to {str(embed_status).lower()}')
 
     @command()
     async def setimgurl(self, ctx: Context, name: str.lower, url: str = None):
         if not self.bot.is_admin(ctx.author):
             return
-        _name = name if name in self.factoids else self.alias_map.get(name)
-        if not _name or _name not in self.factoids:
+        if not (old_factoid := self.store.get(name)):
             return await ctx.send(f'The specified factoid ("{name}") does not exist!')
-
-        factoid = self.factoids[_name]
-        if not factoid['embed']:
+        if not old_factoid.embed:
             return await ctx.send(f'The specified factoid ("{name}") is not en embed!')
 
-        old_factoid = factoid.copy()
-        await self.bot.db.exec(f'''UPDATE "{self.config["db_table"]}" SET image_url=$2 WHERE name=$1''', _name, url)
-
-        await self.fetch_factoids(refresh=True)
+        factoid = await self._update_factoid(old_factoid.name, image_url=url)
         await ctx.send(f'Image URL for "{name}" set to {url}')
-        await self._log_action(ctx.author, new=self.factoids[_name], old=old_factoid)
+        await self._log_action(ctx.author, new=factoid, old=old_factoid)
 
     @command()
     async def info(self, ctx: Context, name: str.lower):
-        _name = name if name in self.factoids else self.alias_map.get(name)
-        if not _name or _name not in self.factoids:
+        if not (factoid := self.store.get(name)):
             return await ctx.send(f'The specified factoid ("{name}") does not exist!')
 
-        factoid = self.factoids[_name]
-        message = factoid["message"].replace('`', '\\`') if factoid["message"] else '<no message>'
-        embed = Embed(title=f'Factoid information: {_name}', description=f'```{message}```')
-        if factoid['aliases']:
-            embed.add_field(name='Aliases', value=', '.join(factoid['aliases']))
-        embed.add_field(name='Uses (since 2018-06-07)', value=str(factoid['uses']))
-        embed.add_field(name='Is Embed', value=str(factoid['embed']))
-        if factoid['image_url']:
-            embed.add_field(name='Image URL', value=factoid['image_url'], inline=False)
+        message = factoid.message.replace('`', '\\`') if factoid.message else '<no message>'
+        embed = Embed(title=f'Factoid information: {factoid.name}', description=f'```{message}```')
+        if factoid.aliases:
+            embed.add_field(name='Aliases', value=', '.join(factoid.aliases))
+        embed.add_field(name='Uses (since 2018-06-07)', value=str(factoid.uses))
+        embed.add_field(name='Uses (last 7 days)', value=str(self.usage.recent(factoid.id)))
+        embed.add_field(name='Is Embed', value=str(factoid.embed))
+        if factoid.image_url:
+            embed.add_field(name='Image URL', value=factoid.image_url, inline=False)
         return await ctx.send(embed=embed)
 
+    def _search_embed(self, terms):
+        embed = Embed(title=f'Factoid search: {terms}'[:256])
+        description = []
+        for name, _ in self.search_index.search(terms):
+            message = ' '.join(self.store.factoids[name].message.split())
+            if len(message) > 80:
+                message = message[:80] + ' [...]'
+            description.append(f'**!{name}** - {message}')
+        embed.description = '\n'.join(description) if description else 'No matching factoids found.'
+        return embed
+
+    @command()
+    async def search(self, ctx: Context, *, terms: str):
+        return await ctx.send(embed=self._search_embed(terms))
+
+    async def slash_search(self, ctx: ApplicationCommandInteraction, terms: str):
+        """
+        Search factoids by content
+
+        Parameters
+        ----------
+        terms: Words to search for
+        """
+        return await ctx.send(embed=self._search_embed(terms), ephemeral=True)
+
+    @command()
+    async def exportfactoids(self, ctx: Context):
+        if not self.bot.is_admin(ctx.author):
+            return
+
+        output = io.BytesIO()
+        query = _export_query.format(factoids=self.config['db_table'])
+        await self.bot.db.copy_from_query(query, output=output, format='csv', header=True)
+        output.seek(0)
+        await ctx.send(f'Exported {len(self.store)} factoids.', file=File(output, filename='factoids.csv'))
+
+    @staticmethod
+    async def _stage_import(conn, data):
+        """COPY CSV data into a temporary staging table (dropped on commit) and return its normalised rows"""
+        await conn.execute(_create_import_table)
+        await conn.copy_to_table(
+            'factoid_import', source=io.BytesIO(data), columns=_import_columns, format='csv', header=True
+        )
+        await conn.execute(_normalise_import_query)
+        return await conn.fetch('SELECT * FROM factoid_import')
+
+    def _diff_import(self, records):
+        """Compare staged factoids with the current ones, returns lists of added and changed factoids and errors"""
+        added, changed, errors = [], [], []
+        imported = [
+            Factoid(None, r['name'], tuple(r['aliases']), r['message'], r['image_url'], r['embed'], 0) for r in records
+        ]
+        factoids = dict(self.store.factoids)
+
+        for name, count in Counter(f.name for f in imported).items():
+            if count > 1:
+                errors.append(f'"{name}" is imported {count} times')
+
+        for factoid in imported:
+            if not factoid.name or factoid.message is None:
+                errors.append(f'Entry "{factoid.name}" is missing a name or message')
+                continue
+            if not (old := self.store.factoids.get(factoid.name)):
+                added.append(factoid)
+            elif any(getattr(old, a) != getattr(factoid, a) for a in ('aliases', 'message', 'image_url', 'embed')):
+                changed.append(factoid)
+            factoids[factoid.name] = factoid
+
+        # names and aliases must remain unique across the resulting set of factoids
+        imported_names = {f.name for f in imported}
+        owners = defaultdict(set)
+        for factoid in factoids.values():
+            for name in factoid.names:
+                owners[name].add(factoid.name)
+        for name, names in owners.items():
+            if len(names) > 1 and names & imported_names:
+                errors.append(f'"{name}" would be used by multiple factoids: {", ".join(sorted(names))}')
+
+        # check for circular references against the resulting set of factoids
+        lookup = {name: f.name for f in factoids.values() for name in f.names}
+        templates = TemplateCache(self.bot.state, self.variables, lookup.get)
+        for name, factoid in factoids.items():
+            templates.set(name, factoid.message or '', factoid.names)
+        for factoid in added + changed:
+            try:
+                templates.check(factoid.name, factoid.message, factoid.names)
+            except ValueError as e:
+                errors.append(f'"{factoid.name}": {e}')
+
+        return added, changed, errors
+
+    @command()
+    async def importfactoids(self, ctx: Context, action: str = None):
+        if not self.bot.is_admin(ctx.author):
+            return
+
+        apply = action == 'apply'
+        if apply:
+            if not self._pending_import or self._pending_import[0] != ctx.author.id:
+                return await ctx.send('No pending import, run `.importfactoids` with a CSV attachment first.')
+            data = self._pending_import[1]
+        elif ctx.message.attachments:
+            data = await ctx.message.attachments[0].read()
+        else:
+            return await ctx.send('Please attach a CSV file (in the format created by `.exportfactoids`).')
+
+        start = time.perf_counter()
+        self._pending_import = None
+        try:
+            # the import is staged and compared again when applying, in case factoids changed after the dry-run
+            async with self.bot.db.acquire() as conn, conn.transaction():
+                added, changed, errors = self._diff_import(await self._stage_import(conn, data))
+                if apply and not errors:
+                    await conn.execute(_update_from_import_query.format(factoids=self.config['db_table']))
+                    await conn.execute(_insert_from_import_query.format(factoids=self.config['db_table']))
+        except asyncpg.PostgresError as e:
+            return await ctx.send(f'Import failed: {e}')
+
+        if not added and not changed and not errors:
+            return await ctx.send('Import contains no changes.')
+
+        embed = Embed(title='Factoid import' if apply and not errors else 'Factoid import (dry-run)')
+        for title, factoids in (('Added', added), ('Changed', changed)):
+            if factoids:
+                names = ', '.join(f.name for f in factoids)
+                embed.add_field(f'{title} ({len(factoids)})', names if len(names) <= 1024 else names[:1018] + ' [...]')
+        if errors:
+            embed.add_field(f'Errors ({len(errors)})', '\n'.join(errors)[:1024], inline=False)
+            embed.description = 'Nothing was imported, please fix the errors and try again.'
+            return await ctx.send(embed=embed)
+        if not apply:
+            self._pending_import = (ctx.author.id, data)
+            embed.description = 'Run `.importfactoids apply` to import these changes.'
+            return await ctx.send(embed=embed)
+
+        # rebuild the snapshot and all indexes once instead of once per factoid
+        await self.fetch_factoids()
+        logger.info(
+            f'Imported {len(added)} new and {len(changed)} changed factoids in {time.perf_counter() - start:.3f}s'
+        )
+        await ctx.send(embed=embed)
+        if self.log_channel:
+            embed.colour = self._log_colour
+            embed.description = f'**User:** {ctx.author.mention}'
+            await self.log_channel.send(embed=embed)
+
+    @command()
+    async def togglesuggestions(self, ctx: Context):
+        if not self.bot.is_admin(ctx.author):
+            return
+
+        self.suggestion_channels ^= {ctx.channel.id}
+        self.bot.state['factoid_suggestion_channels'] = sorted(self.suggestion_channels)
+        enabled = ctx.channel.id in self.suggestion_channels
+        await ctx.send('Factoid suggestions {} for this channel.'.format('enabled' if enabled else 'disabled'))
+
     @command()
-    async def top(self, ctx: Context):
-        embed = Embed(title='Top Factoids')
+    async def top(self, ctx: Context, period: str = None):
+        try:
+            uses = await self._get_uses(period)
+        except ValueError as e:
+            return await ctx.send(str(e))
+
+        embed = Embed(title='Top Factoids' + (f' (last {period})' if period else ''))
         description = ['Pos - Factoid (uses)', '--------------------------------']
-        for pos, fac in enumerate(sorted(self.factoids.values(), key=lambda a: a['uses'], reverse=True)[:10], start=1):
-            description.append(f'{pos:2d}. - {fac["name"]} ({fac["uses"]})')
+        for pos, (name, count) in enumerate(heapq.nlargest(10, uses.items(), key=lambda a: a[1]), start=1):
+            description.append(f'{pos:2d}. - {name} ({count})')
         embed.description = '```{}```'.format('\n'.join(description))
         return await ctx.send(embed=embed)
 
     @command()
-    async def bottom(self, ctx: Context):
-        embed = Embed(title='Least used Factoids')
+    async def bottom(self, ctx: Context, period: str = None):
+        try:
+            uses = await self._get_uses(period)
+        except ValueError as e:
+            return await ctx.send(str(e))
+
+        embed = Embed(title='Least used Factoids' + (f' (last {period})' if period else ''))
         description = ['Pos - Factoid (uses)', '--------------------------------']
-        for pos, fac in enumerate(sorted(self.factoids.values(), key=lambda a: a['uses'])[:10], start=1):
-            description.append(f'{pos:2d}. - {fac["name"]} ({fac["uses"]})')
+        for pos, (name, count) in enumerate(heapq.nsmallest(10, uses.items(), key=lambda a: a[1]), start=1):
+            description.append(f'{pos:2d}. - {name} ({count})')
         embed.description = '```{}```'.format('\n'.join(description))
         return await ctx.send(embed=embed)
 
     @command()
-    async def unused(self, ctx: Context):
-        embed = Embed(title='Unused Factoids')
-        description = []
-        for fac in sorted(self.factoids.values(), key=lambda a: a['uses']):
-            if fac['uses'] > 0:
-                break
-            description.append(f'- {fac["name"]}')
+    async def unused(self, ctx: Context, period: str = None):
+        try:
+            uses = await self._get_uses(period)
+        except ValueError as e:
+            return await ctx.send(str(e))
+
+        embed = Embed(title='Unused Factoids' + (f' (last {period})' if period else ''))
+        description = [f'- {name}' for name, count in sorted(uses.items()) if not count]
         embed.description = '```{}```'.format('\n'.join(description))
         return await ctx.send(embed=embed)
 
@@ -500,7 +982,8 @@ def setup(bot):
     if 'factoids' in bot.config and bot.config['factoids'].get('enabled', False):
         fac = Factoids(bot, bot.config['factoids'])
         bot.add_cog(fac)
-        bot.loop.create_task(fac.fetch_factoids())
+        fac.reconcile.start()
+        fac.usage_flusher.start()
         bot.loop.create_task(fac.init_logging())
     else:
         logger.info('Factoids Cog not enabled.')
@@ -1,13 +1,47 @@
+import asyncio
 import logging
 import math
 import re
 import time
 
-from disnake import Message, Embed
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from disnake import Message, Embed, Thread
+from disnake.ext import tasks
 from disnake.ext.commands import Cog, Context, command
 
+from .utils.corpus import MessageCorpus, backtest
+from .utils.filters import (
+    TIER_BAN,
+    TIER_DELETE,
+    TIER_KICK,
+    GLOBAL_SCOPE,
+    FilterError,
+    FilterScope,
+    FilterStats,
+    FilterTimeout,
+    ScopedFilterEngine,
+    VerdictCache,
+    compile_filter,
+)
+from .utils.domains import extract_hosts, normalize_host, parse_domain_list
+from .utils.images import BKTree, HashCache, dhash
+from .utils.moderation import LogBatcher, ModerationQueue, chunk_embeds, paginate_fields, split_lines
+from .utils.normalize import normalization_sensitive, normalize, normalize_message
+from .utils.raid import RaidDetector
+from .utils.ratelimit import RateLimiter
+from .utils.trie import DomainTrie
+
 logger = logging.getLogger(__name__)
 
+# in order of severity
+_punishments = ('none', 'kick', 'ban')
+# <#channel>, <@&role> or a bare ID
+_scope_target_re = re.compile(r'<(#|@&)(\d+)>|(\d+)')
+_stats_columns = ('matches', 'deletes', 'kicks', 'bans', 'last_match', 'eval_time', 'eval_max', 'eval_buckets')
+
 
 class OnlyBans(Cog):
     def __init__(self, bot, config):
@@ -19,7 +53,78 @@ class OnlyBans(Cog):
         self.filters = dict()
         self.bannable = set()
         self.kickable = set()
-        self.sorted_filters = []
+        # filters that only record would-be matches, evaluated by their own engine and worker after the live ones
+        self.shadow = set()
+        # name -> FilterScope of filters restricted to some channels/categories/roles
+        self.scopes = dict()
+        # evaluates all filters in one pass per punishment tier, with separate engines for every scope
+        self.engine = ScopedFilterEngine()
+        self.shadow_engine = ScopedFilterEngine()
+        self.shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow-filters')
+        # shadow evaluations waiting for the worker, messages are skipped while there are too many (e.g. in a raid)
+        self._shadow_pending = 0
+        self.shadow_queue_limit = self.config.get('shadow_queue_limit', 100)
+        self.shadow_skipped = 0
+        # would-be matches since the last digest, and a few samples of them
+        self.shadow_hits = Counter()
+        self.shadow_samples = defaultdict(list)
+        if intv := self.config.get('shadow_digest_interval'):
+            self.shadow_digest.change_interval(seconds=intv)
+        # filters run in a worker so that a slow regex can't block the event loop, the regex module releases the GIL
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='filters')
+        # timing every filter on its own is much slower than a search, it must not delay the live filters
+        self.profile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='filter-profiling')
+        self._profiling = False
+        # seconds all filters combined may take per message, filters taking longer on their own are quarantined
+        self.time_budget = self.config.get('time_budget', 0.05)
+        # verdicts of recent messages, repeated (spam) messages are classified without running the filters again
+        self.verdicts = VerdictCache(self.config.get('verdict_cache_size', 4096))
+        # deletes, bans and kicks run in the background, deletes are merged into bulk deletes per channel
+        self.actions = ModerationQueue(self.config.get('action_concurrency', 4))
+        # sends to the log channel, matches are merged per filter and user during bursts
+        self.modlog = LogBatcher(self.config.get('log_batch_window', 2.0))
+        # recent public messages to backtest filters against, backtests get their own worker
+        self.corpus = MessageCorpus(
+            self.config.get('corpus_dir'),
+            max_bytes=int(self.config.get('corpus_size', 16) * 1024 * 1024),
+        )
+        self.backtest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backtest')
+        # message floods and near-duplicate spam across accounts/channels, reported to the mod log
+        self.raid_detector = None
+        if self.config.get('raid_detection', True):
+            self.raid_detector = RaidDetector(
+                window=self.config.get('raid_window', 30.0),
+                user_rate=self.config.get('raid_user_rate', 10),
+                guild_rate=self.config.get('raid_guild_rate', 300),
+                duplicate_users=self.config.get('raid_duplicate_users', 3),
+                duplicate_channels=self.config.get('raid_duplicate_channels', 3),
+                threshold=self.config.get('raid_similarity', 0.5),
+            )
+            # one alert per kind (and user) per window
+            self.raid_alerts = RateLimiter(self.raid_detector.window)
+        # blocked images: name -> hashes and punishment ('none', 'kick' or 'ban'), looked up by Hamming distance
+        # blocked domain -> punishment ('none', 'kick' or 'ban'), subdomains of blocked domains are blocked as well
+        self.domain_table = self.config.get('domain_table', 'domain_blocklist')
+        self.blocked_domains = DomainTrie()
+        self.domain_matches = 0
+        self.image_table = self.config.get('image_table', 'image_blocklist')
+        self.blocked_images = dict()
+        self.image_punishments = dict()
+        self.image_tree = BKTree()
+        self.image_max_distance = self.config.get('image_max_distance', 6)
+        # attachments up to this size are hashed, decoding runs in a small worker pool and downloads are bounded too
+        self.image_max_size = int(self.config.get('image_max_size', 8) * 1024 * 1024)
+        self.image_executor = ThreadPoolExecutor(
+            max_workers=self.config.get('image_workers', 2), thread_name_prefix='image-hashes'
+        )
+        self.image_downloads = asyncio.Semaphore(self.config.get('image_downloads', 4))
+        self.image_hashes = HashCache(self.config.get('image_cache_size', 4096))
+        self.image_matches = 0
+        # name -> FilterStats, every `stats_sample_interval`th message is used to time each filter on its own
+        self.stats = dict()
+        self.stats_sample_interval = self.config.get('stats_sample_interval', 100)
+        if intv := self.config.get('stats_flush_interval'):
+            self.stats_flusher.change_interval(seconds=intv)
 
         if self.bot.state.get('mod_deletes') is None:
             self.bot.state['mod_deletes'] = 0
@@ -29,6 +134,9 @@ class OnlyBans(Cog):
             self.bot.state['mod_bans'] = 0
         if self.bot.state.get('mod_kicks') is None:
             self.bot.state['mod_kicks'] = 0
+        # filter name -> regex that exceeded the time budget, kept out of the engine until the regex is changed
+        if self.bot.state.get('filter_quarantine') is None:
+            self.bot.state['filter_quarantine'] = dict()
 
         # timestamps for stats
         if self.bot.state.get('mod_falsepositive_ts') is None:
@@ -48,8 +156,19 @@ class OnlyBans(Cog):
                     ('.addfilter "<name>" `<regex>`', 'Add regex-based message filter'),
                     ('.modfilter "<name>" `<regex>`', 'Update regex of filter'),
                     ('.delfilter "<name>"', 'Delete filter'),
+                    ('.shadowfilter "<name>" `<regex>`', 'Add filter that only reports would-be matches'),
+                    ('.promotefilter "<name>"', 'Make shadow filter live'),
                     ('.setpunishment "<name>" [none/kick/ban]', 'sets additional violation action (default: none)'),
+                    ('.setscope "<name>" [#channel/category/@role ...]', 'Restrict filter (default: everywhere)'),
                     ('.testfilters <message>', 'Test if message gets caught by any filter'),
+                    ('.backtestfilter "<name>" `<regex>`', 'Test regex against recent messages before adding it'),
+                    ('.blockdomain <domain> [none/kick/ban]', 'Block domain and its subdomains in messages'),
+                    ('.unblockdomain <domain>', 'Remove domain from blocklist'),
+                    ('.importdomains [none/kick/ban]', 'Block all domains in attached list (one per line)'),
+                    ('.listdomains [search]', 'List blocked domains'),
+                    ('.blockimage "<name>" [none/kick/ban]', 'Block images attached to (or replied to by) command'),
+                    ('.unblockimage "<name>"', 'Remove images from blocklist'),
+                    ('.listimages', 'List blocked images'),
                     ('.togglefiltering', 'Enable/Disable filtering'),
                     ('.filterstats', 'Print some stats'),
                     ('.resettheclock', 'Reset days since last false-positive to 0'),
@@ -57,13 +176,39 @@ class OnlyBans(Cog):
                 restricted=True,
             )
 
-    def sort_filters(self):
-        self.sorted_filters = sorted(
-            self.filters.items(), reverse=True, key=lambda a: (a[0] in self.bannable) * 2 + (a[0] in self.kickable)
-        )
-        logger.info(f'Presorted {len(self.sorted_filters)} filters.')
+    def cog_unload(self):
+        self.stats_flusher.cancel()
+        self.shadow_digest.cancel()
+        self.bot.loop.create_task(self.flush_stats())
+        self.executor.shutdown(wait=False)
+        self.profile_executor.shutdown(wait=False)
+        self.shadow_executor.shutdown(wait=False)
+        self.image_executor.shutdown(wait=False)
+        self.backtest_executor.shutdown(wait=False)
+        self.corpus.flush()
+
+    @property
+    def quarantined(self):
+        return self.bot.state['filter_quarantine']
+
+    def update_engine(self, name):
+        """Add/update/remove filter in the engines according to its current regex, punishment, quarantine and shadow"""
+        if name in self.quarantined and self.quarantined[name] != getattr(self.filters.get(name), 'pattern', None):
+            self.bot.state['filter_quarantine'] = {k: v for k, v in self.quarantined.items() if k != name}
+        tier = TIER_BAN if name in self.bannable else TIER_KICK if name in self.kickable else TIER_DELETE
+        live = name in self.filters and name not in self.quarantined and name not in self.shadow
+        shadow = name in self.filters and name in self.shadow
+        for engine, active in ((self.engine, live), (self.shadow_engine, shadow)):
+            if active:
+                # filters with characters that normalization changes also have to see the message as it was sent
+                raw = normalization_sensitive(self.filters[name].pattern)
+                engine.set(name, self.filters[name], tier, self.scopes.get(name, GLOBAL_SCOPE), raw)
+            else:
+                engine.remove(name)
 
     async def fetch_filters(self):
+        await self.fetch_blocked_domains()
+        await self.fetch_blocked_images()
         # fetch existing filters from DB
         rows = await self.bot.db.query(f'SELECT * FROM "{self.config["db_table"]}"')
         if not rows:
@@ -71,22 +216,85 @@ class OnlyBans(Cog):
             return
         for row in rows:
             try:
-                self.filters[row['name']] = re.compile(row['regex'], re.IGNORECASE | re.DOTALL)
+                self.filters[row['name']] = compile_filter(row['regex'])
+                self.stats[row['name']] = FilterStats(row)
                 if row.get('bannable', False):
                     self.bannable.add(row['name'])
                 elif row.get('kickable', False):
                     self.kickable.add(row['name'])
-            except re.error as e:
+                if row.get('shadow', False):
+                    self.shadow.add(row['name'])
+                if row.get('channels') or row.get('roles'):
+                    self.scopes[row['name']] = FilterScope(row.get('channels') or (), row.get('roles') or ())
+                self.update_engine(row['name'])
+                if normalization_sensitive(row['regex']):
+                    logger.info(f'Filter "{row["name"]}" is also matched against messages before normalization')
+            except FilterError as e:
                 logger.error(f'Compiling filter "{row["name"]}" failed with: {e}')
         logger.info(f'Fetched {len(self.filters)} filters from database.')
-        self.sort_filters()
+        if self.quarantined:
+            logger.warning(f'Filters still quarantined for being too slow: {", ".join(self.quarantined)}')
         # wait for bot to be fully online before trying to find modlog channel
         await self.bot.wait_until_ready()
         # find channel
-        self.log_channel = self.bot.get_channel(self.config['log_channel'])
+        self.log_channel = self.modlog.channel = self.bot.get_channel(self.config['log_channel'])
         if self.log_channel:
             logger.info(f'Found moderation log channel: {self.log_channel}')
 
+    async def fetch_blocked_domains(self):
+        rows = await self.bot.db.query(f'SELECT * FROM "{self.domain_table}"')
+        self.blocked_domains = DomainTrie((row['domain'], row['punishment'] or 'none') for row in rows or ())
+        logger.info(f'Fetched {len(self.blocked_domains)} blocked domains from database.')
+
+    async def fetch_blocked_images(self):
+        rows = await self.bot.db.query(f'SELECT * FROM "{self.image_table}"')
+        for row in rows or ():
+            self.blocked_images.setdefault(row['name'], set()).add(int(row['hash'], 16))
+            self.image_punishments[row['name']] = row['punishment'] or 'none'
+        self.rebuild_image_tree()
+        logger.info(f'Fetched {len(self.image_tree)} blocked images from database.')
+
+    def rebuild_image_tree(self):
+        self.image_tree = BKTree(
+            (image_hash, name) for name, hashes in self.blocked_images.items() for image_hash in hashes
+        )
+
+    async def flush_stats(self):
+        if not (dirty := [(name, stats) for name, stats in self.stats.items() if stats.dirty]):
+            return
+        for _, stats in dirty:
+            stats.dirty = False
+
+        assignments = ', '.join(f'"{column}"=${idx}' for idx, column in enumerate(_stats_columns, 2))
+        try:
+            await self.bot.db.exec_multi(
+                f'UPDATE "{self.config["db_table"]}" SET {assignments} WHERE "name"=$1',
+                [(name, *stats.values()) for name, stats in dirty],
+            )
+        except Exception as e:
+            logger.error(f'Persisting filter stats failed: {e!r}')
+            for _, stats in dirty:
+                stats.dirty = True
+
+    @tasks.loop(seconds=300.0)
+    async def stats_flusher(self):
+        await self.flush_stats()
+
+    async def sample_costs(self, text, raw=None):
+        """Time every filter on its own for text in the profiling worker, samples are dropped while one is running"""
+        if self._profiling:
+            return
+        self._profiling = True
+        try:
+            timings = await self.bot.loop.run_in_executor(
+                self.profile_executor, self.engine.profile, text, self.time_budget, raw
+            )
+        finally:
+            self._profiling = False
+        for name, seconds in timings.items():
+            if stats := self.stats.get(name):
+                stats.record_cost(seconds)
+
     @command()
     async def listfilters(self, ctx: Context):
         if not self.bot.is_admin(ctx.author):
@@ -97,25 +305,38 @@ class OnlyBans(Cog):
         _ban_filters = []
         _kick_filters = []
         _delete_filters = []
+        _shadow_filters = []
         for name, regex in sorted(self.filters.items()):
-            if name in self.bannable:
-                _ban_filters.append(f'* "{name}" - `{regex.pattern}`')
+            if name in self.quarantined:
+                continue
+            line = f'* "{name}" - `{regex.pattern}` ({self.stats.setdefault(name, FilterStats()).summary()})'
+            if name in self.scopes:
+                line += f' [only {self.describe_scope(self.scopes[name])}]'
+            if name in self.shadow:
+                _shadow_filters.append(line)
+            elif name in self.bannable:
+                _ban_filters.append(line)
             elif name in self.kickable:
-                _kick_filters.append(f'* "{name}" - `{regex.pattern}`')
+                _kick_filters.append(line)
             else:
-                _delete_filters.append(f'* "{name}" - `{regex.pattern}`')
-
-        embed = Embed(title='Registered Message Filters')
-        if _ban_filters:
-            embed.add_field(name='Ban Filters', inline=False, value='```\n{}\n```'.format('\n'.join(_ban_filters)))
-        if _kick_filters:
-            embed.add_field(name='Kick Filters', inline=False, value='```\n{}\n```'.format('\n'.join(_kick_filters)))
-        if _delete_filters:
-            embed.add_field(
-                name='Delete Filters', inline=False, value='```\n{}\n```'.format('\n'.join(_delete_filters))
-            )
+                _delete_filters.append(line)
 
-        return await ctx.send(embed=embed)
+        _quarantined = [f'* "{name}" - `{regex}`' for name, regex in sorted(self.quarantined.items())]
+
+        # long lists are split over several fields and embeds to stay within Discord's limits
+        fields = []
+        for title, lines in (
+            ('Ban Filters', _ban_filters),
+            ('Kick Filters', _kick_filters),
+            ('Delete Filters', _delete_filters),
+            ('Shadow Filters (no action taken, make live with .promotefilter)', _shadow_filters),
+            ('Quarantined Filters (too slow, fix with .modfilter)', _quarantined),
+        ):
+            for idx, value in enumerate(split_lines(lines, '```\n{}\n```')):
+                fields.append((title if idx == 0 else f'{title} (continued)', value))
+
+        for embeds in chunk_embeds(paginate_fields('Registered Message Filters', fields)):
+            await ctx.send(embeds=embeds)
 
     @command()
     async def addfilter(self, ctx: Context, name: str, *, regex: str):
@@ -130,15 +351,67 @@ class OnlyBans(Cog):
             return await ctx.send(f'Filter "{name}" already exists.')
 
         try:
-            self.filters[name] = re.compile(regex, re.IGNORECASE | re.DOTALL)
-            self.sort_filters()
-        except re.error as e:
-            return await ctx.send(f'Compiling regex failed: {e}')
+            self.filters[name] = compile_filter(regex, check_risk=True)
+            self.update_engine(name)
+        except FilterError as e:
+            return await ctx.send(str(e))
 
+        self.stats[name] = FilterStats()
         await self.bot.db.exec(
             f'''INSERT INTO "{self.config["db_table"]}" (name, regex) VALUES ($1, $2)''', name, regex
         )
-        return await ctx.send(f'Added filter `{name}` (regex: `{regex}`) to filter list.')
+        return await ctx.send(
+            f'Added filter `{name}` (regex: `{regex}`) to filter list.' + self.normalization_note(regex)
+        )
+
+    @command()
+    async def shadowfilter(self, ctx: Context, name: str, *, regex: str):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+        regex = regex.strip().strip('"').strip('`')
+        name = name.strip()
+
+        if name in self.filters:
+            return await ctx.send(f'Filter "{name}" already exists.')
+
+        try:
+            self.filters[name] = compile_filter(regex, check_risk=True)
+            self.shadow.add(name)
+            self.update_engine(name)
+        except FilterError as e:
+            return await ctx.send(str(e))
+
+        self.stats[name] = FilterStats()
+        await self.bot.db.exec(
+            f'''INSERT INTO "{self.config["db_table"]}" (name, regex, shadow) VALUES ($1, $2, true)''', name, regex
+        )
+        return await ctx.send(
+            f'Added shadow filter `{name}` (regex: `{regex}`), it will only report would-be matches. '
+            f'Use `.setpunishment` to choose what it should do once live and `.promotefilter` to make it live.'
+            + self.normalization_note(regex)
+        )
+
+    @command()
+    async def promotefilter(self, ctx: Context, *, name: str):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        if name not in self.shadow:
+            return await ctx.send(f'No shadow filter named "{name}" exists.')
+
+        self.shadow.discard(name)
+        self.shadow_hits.pop(name, None)
+        self.shadow_samples.pop(name, None)
+        # would-be matches shouldn't count as matches of the live filter
+        self.stats[name] = FilterStats()
+        self.stats[name].dirty = True
+        self.update_engine(name)
+        await self.bot.db.exec(f'''UPDATE "{self.config["db_table"]}" SET "shadow"=false WHERE "name"=$1''', name)
+        return await ctx.send(f'Filter `{name}` is now live.')
 
     @command()
     async def modfilter(self, ctx: Context, name: str, *, regex: str):
@@ -153,13 +426,26 @@ class OnlyBans(Cog):
             return await ctx.send(f'Filter "{name}" does not exists.')
 
         try:
-            self.filters[name] = re.compile(regex, re.IGNORECASE | re.DOTALL)
-            self.sort_filters()
-        except re.error as e:
-            return await ctx.send(f'Compiling regex failed: {e}')
+            self.filters[name] = compile_filter(regex, check_risk=True)
+            self.update_engine(name)
+        except FilterError as e:
+            return await ctx.send(str(e))
 
+        # evaluation cost of the old regex says nothing about the new one
+        self.stats.setdefault(name, FilterStats()).reset_cost()
         await self.bot.db.exec(f'''UPDATE "{self.config["db_table"]}" SET "regex"=$1 WHERE "name"=$2''', regex, name)
-        return await ctx.send(f'Updated filter `{name}` to `{regex}`.')
+        return await ctx.send(f'Updated filter `{name}` to `{regex}`.' + self.normalization_note(regex))
+
+    @staticmethod
+    def normalization_note(regex):
+        if not normalization_sensitive(regex):
+            return ''
+        example = f' (e.g. `{normalized}`)' if (normalized := normalize(regex)) else ''
+        return (
+            f'\nNote: filters are matched against messages with look-alike characters replaced and invisible ones '
+            f'removed{example}. This regex contains characters that are changed by that, so it is '
+            f'also matched against the original message, which costs a second search for such messages.'
+        )
 
     @command()
     async def delfilter(self, ctx: Context, *, name: str):
@@ -172,7 +458,10 @@ class OnlyBans(Cog):
             return await ctx.send(f'No filter named "{name}" exists.')
         else:
             regex = self.filters.pop(name)
-            self.sort_filters()
+            self.stats.pop(name, None)
+            self.shadow.discard(name)
+            self.scopes.pop(name, None)
+            self.update_engine(name)
 
         await self.bot.db.exec(f'''DELETE FROM "{self.config["db_table"]}" WHERE "name"=$1''', name)
         return await ctx.send(f'Removed filter `{name}` (regex: `{regex.pattern}`).')
@@ -216,7 +505,236 @@ class OnlyBans(Cog):
         else:
             await ctx.send(f'Filter `{name}` has been set to delete only.')
 
-        self.sort_filters()
+        self.update_engine(name)
+
+    @command()
+    async def setscope(self, ctx: Context, name: str, *targets: str):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        if name not in self.filters:
+            return await ctx.send(f'No filter named "{name}" exists.')
+
+        channels, roles = set(), set()
+        for target in targets:
+            if not (m := _scope_target_re.fullmatch(target.strip())):
+                return await ctx.send(f'Invalid channel or role: "{target}"')
+            kind, mention_id, bare_id = m.groups()
+            target_id = int(mention_id or bare_id)
+            if kind != '@&' and self.bot.get_channel(target_id):
+                channels.add(target_id)
+            elif kind != '#' and self.get_role(target_id):
+                roles.add(target_id)
+            else:
+                return await ctx.send(f'No channel or role with ID {target_id} found.')
+
+        scope = FilterScope(channels, roles)
+        if scope == GLOBAL_SCOPE:
+            self.scopes.pop(name, None)
+        else:
+            self.scopes[name] = scope
+        await self.bot.db.exec(
+            f'''UPDATE "{self.config["db_table"]}" SET "channels"=$1, "roles"=$2 WHERE "name"=$3''',
+            sorted(channels),
+            sorted(roles),
+            name,
+        )
+        self.update_engine(name)
+        return await ctx.send(f'Filter `{name}` now applies {self.describe_scope(scope)}.')
+
+    def get_role(self, role_id):
+        for guild in self.bot.guilds:
+            if role := guild.get_role(role_id):
+                return role
+        return None
+
+    def describe_scope(self, scope: FilterScope):
+        if scope == GLOBAL_SCOPE:
+            return 'everywhere'
+        parts = []
+        if scope.channels:
+            names = (f'#{c.name}' if (c := self.bot.get_channel(i)) else str(i) for i in sorted(scope.channels))
+            parts.append('in ' + ', '.join(names))
+        if scope.roles:
+            names = (f'@{r.name}' if (r := self.get_role(i)) else str(i) for i in sorted(scope.roles))
+            parts.append('to ' + ', '.join(names))
+        return ' and '.join(parts)
+
+    async def add_blocked_domains(self, domains, punishment):
+        """Add domains to the blocklist (or update their punishment) with a single query"""
+        await self.bot.db.exec(
+            f'''INSERT INTO "{self.domain_table}" (domain, punishment) SELECT unnest($1::text[]), $2
+            ON CONFLICT (domain) DO UPDATE SET punishment=EXCLUDED.punishment''',
+            domains,
+            punishment,
+        )
+        for domain in domains:
+            self.blocked_domains.add(domain, punishment)
+
+    @command()
+    async def blockdomain(self, ctx: Context, domain: str, punishment: str = 'none'):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        punishment = punishment.strip().lower()
+        if punishment not in ('none', 'ban', 'kick'):
+            return await ctx.send(f'Invalid punishment: "{punishment}"')
+        if not (domains := parse_domain_list(domain.strip('<>`'))):
+            return await ctx.send(f'Invalid domain: "{domain}"')
+
+        if entry := self.blocked_domains.match(domains[0]):
+            await ctx.send(f'Note: `{domains[0]}` is already covered by blocked domain `{entry[0]}` ({entry[1]}).')
+        await self.add_blocked_domains(domains, punishment)
+        return await ctx.send(f'Blocked domain `{domains[0]}` and its subdomains (punishment: {punishment}).')
+
+    @command()
+    async def unblockdomain(self, ctx: Context, domain: str):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        domain = normalize_host(domain.strip('<>`'))
+        if not self.blocked_domains.remove(domain):
+            return await ctx.send(f'Domain `{domain}` is not blocked.')
+        await self.bot.db.exec(f'''DELETE FROM "{self.domain_table}" WHERE "domain"=$1''', domain)
+        return await ctx.send(f'Removed `{domain}` from the domain blocklist.')
+
+    @command()
+    async def importdomains(self, ctx: Context, punishment: str = 'none'):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        punishment = punishment.strip().lower()
+        if punishment not in ('none', 'ban', 'kick'):
+            return await ctx.send(f'Invalid punishment: "{punishment}"')
+        if not ctx.message.attachments:
+            return await ctx.send('Attach a text file with one domain per line.')
+
+        domains = set()
+        for attachment in ctx.message.attachments:
+            data = await attachment.read()
+            domains.update(parse_domain_list(data.decode('utf-8', 'replace')))
+        if not domains:
+            return await ctx.send('No domains found in the attached files.')
+
+        new = sum(self.blocked_domains.match(domain) is None for domain in domains)
+        await self.add_blocked_domains(sorted(domains), punishment)
+        return await ctx.send(
+            f'Imported {len(domains)} domains ({new} not blocked before, punishment: {punishment}), '
+            f'{len(self.blocked_domains)} domains are blocked now.'
+        )
+
+    @command()
+    async def listdomains(self, ctx: Context, search: str = ''):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        search = search.lower()
+        entries = sorted(
+            (domain, punishment) for domain, punishment in self.blocked_domains.items() if search in domain
+        )
+        if not entries:
+            return await ctx.send('No matching domains are blocked.')
+        punishments = Counter(punishment for _, punishment in entries)
+        lines = [f'* {domain} ({punishment})' for domain, punishment in entries[:100]]
+        if len(entries) > 100:
+            lines.append(f'... and {len(entries) - 100} more')
+        embed = Embed(title='Blocked Domains', description='```\n{}\n```'.format('\n'.join(lines))[:4000])
+        embed.set_footer(text=', '.join(f'{count} {punishment}' for punishment, count in sorted(punishments.items())))
+        return await ctx.send(embed=embed)
+
+    async def hash_command_images(self, ctx: Context):
+        """Hashes of the images attached to the command message, or to the message it replies to"""
+        attachments = list(ctx.message.attachments)
+        if ctx.message.reference and isinstance(ctx.message.reference.resolved, Message):
+            attachments.extend(ctx.message.reference.resolved.attachments)
+        hashes = []
+        for attachment in attachments:
+            data = await attachment.read()
+            try:
+                hashes.append(await self.bot.loop.run_in_executor(self.image_executor, dhash, data))
+            except Exception as e:
+                await ctx.send(f'`{attachment.filename}` is not a supported image: {e!r}')
+        return hashes
+
+    @command()
+    async def blockimage(self, ctx: Context, name: str, punishment: str = 'none'):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        punishment = punishment.strip().lower()
+        if punishment not in ('none', 'ban', 'kick'):
+            return await ctx.send(f'Invalid punishment: "{punishment}"')
+        if not (hashes := await self.hash_command_images(ctx)):
+            return await ctx.send('Attach the images to block, or reply to a message with them.')
+
+        message = []
+        for image_hash in hashes:
+            if matches := self.image_tree.search(image_hash, self.image_max_distance):
+                distance, other = matches[0]
+                message.append(f'`{image_hash:016x}` is already blocked as `{other}` (distance {distance}).')
+                continue
+            await self.bot.db.exec(
+                f'''INSERT INTO "{self.image_table}" (name, hash, punishment) VALUES ($1, $2, $3)''',
+                name,
+                f'{image_hash:016x}',
+                punishment,
+            )
+            self.blocked_images.setdefault(name, set()).add(image_hash)
+            self.image_tree.add(image_hash, name)
+            message.append(f'Blocked image `{image_hash:016x}` as `{name}`.')
+        if name in self.blocked_images:
+            self.image_punishments[name] = punishment
+            await self.bot.db.exec(
+                f'''UPDATE "{self.image_table}" SET "punishment"=$1 WHERE "name"=$2''',
+                punishment,
+                name,
+            )
+        return await ctx.send('\n'.join(message))
+
+    @command()
+    async def unblockimage(self, ctx: Context, *, name: str):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        if name not in self.blocked_images:
+            return await ctx.send(f'No blocked image named "{name}" exists.')
+        hashes = self.blocked_images.pop(name)
+        self.image_punishments.pop(name, None)
+        self.rebuild_image_tree()
+        await self.bot.db.exec(f'''DELETE FROM "{self.image_table}" WHERE "name"=$1''', name)
+        return await ctx.send(f'Removed {len(hashes)} blocked images named `{name}`.')
+
+    @command()
+    async def listimages(self, ctx: Context):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+
+        if not self.blocked_images:
+            return await ctx.send('No images are blocked.')
+        lines = [
+            f'* "{name}" ({self.image_punishments.get(name, "none")}) - '
+            + ', '.join(f'{image_hash:016x}' for image_hash in sorted(hashes))
+            for name, hashes in sorted(self.blocked_images.items())
+        ]
+        embed = Embed(title='Blocked Images', description='```\n{}\n```'.format('\n'.join(lines))[:4096])
+        embed.set_footer(text=f'Images within a Hamming distance of {self.image_max_distance} are blocked')
+        return await ctx.send(embed=embed)
 
     @command()
     async def togglefiltering(self, ctx: Context):
@@ -235,21 +753,89 @@ class OnlyBans(Cog):
         if not self.bot.is_private(ctx.channel):
             return
 
-        matches = []
-        for name, regex in self.sorted_filters:
-            m = regex.search(message)
-            if m:
-                matches.append((name, regex.pattern, m.group()))
+        # filters see the normalized message
+        text = normalize(message)
+        normalized = [f'Normalized message: `{text[:1000]}`'] if text != message else []
+        results, timed_out = await self.bot.loop.run_in_executor(
+            self.executor, self.engine.search_all, text, self.time_budget, message
+        )
+        matches = [(name, regex.pattern, m.group()) for name, regex, m in results]
+        hosts = extract_hosts(message) | extract_hosts(text)
+        domains = [(host, entry) for host in sorted(hosts) if (entry := self.blocked_domains.match(host))]
 
-        if not matches:
-            return await ctx.send('No filters matched.')
+        if not matches and not timed_out and not domains:
+            return await ctx.send('\n'.join(['No filters matched.'] + normalized))
 
-        message = ['The following filters matched:']
+        message = ['The following filters matched:'] if matches else ['No filters matched.']
         for name, pat, res in matches:
-            message.append(f'- Name: `{name}`, Regex: `{pat}`, Match: `{res}`')
+            line = f'- Name: `{name}`, Regex: `{pat}`, Match: `{res}`'
+            if name in self.scopes:
+                line += f' (only applies {self.describe_scope(self.scopes[name])})'
+            message.append(line)
+        if timed_out:
+            message.append('Filters exceeding the time budget: {}'.format(', '.join(f'`{n}`' for n in timed_out)))
+        for host, (domain, punishment) in domains:
+            message.append(f'- Blocked domain: `{domain}` (host: `{host}`, punishment: {punishment})')
+        message.extend(normalized)
 
         return await ctx.send('\n'.join(message))
 
+    @command()
+    async def backtestfilter(self, ctx: Context, name: str, *, regex: str):
+        if not self.bot.is_admin(ctx.author):
+            return
+        if not self.bot.is_private(ctx.channel):
+            return
+        regex = regex.strip().strip('"').strip('`')
+        name = name.strip()
+
+        try:
+            candidate = compile_filter(regex, check_risk=True)
+        except FilterError as e:
+            return await ctx.send(str(e))
+        if not len(self.corpus):
+            return await ctx.send('No messages have been collected yet.')
+
+        await ctx.send(f'Backtesting `{regex}` against {len(self.corpus)} recent messages...')
+        start = time.perf_counter()
+        result = await self.bot.loop.run_in_executor(
+            self.backtest_executor,
+            partial(backtest, normalize=normalize),
+            self.corpus.messages(self.corpus.snapshot()),
+            candidate,
+            self.engine,
+            self.time_budget,
+            name,
+        )
+        elapsed = time.perf_counter() - start
+
+        embed = Embed(
+            title=f'Backtest of "{name}"',
+            description=f'Matched **{result.matches}** of {result.messages} messages '
+            f'({result.matches / (result.messages or 1) * 100:.2f}%)',
+        )
+        if result.samples:
+            samples = [f'`{match[:100]}` in "{text[:150]}"' for text, match in result.samples]
+            embed.add_field(name='Sample matches', value='\n'.join(samples)[:1024], inline=False)
+        if result.matches:
+            overlap = ', '.join(f'`{n}` ({count})' for n, count in result.overlap.most_common(5))
+            embed.add_field(
+                name='Overlap with existing filters',
+                value=f'{result.caught} of {result.matches} matches are already caught'
+                + (f': {overlap}' if overlap else ''),
+                inline=False,
+            )
+        latency = result.latency
+        cost = (
+            f'mean: {latency.mean * 1_000_000:.1f} µs, p95: {latency.percentile(0.95) * 1_000_000:.0f} µs, '
+            f'max: {latency.max * 1_000_000:.0f} µs'
+        )
+        if result.timeouts:
+            cost += f'\n**{result.timeouts} messages exceeded the time budget**'
+        embed.add_field(name='Evaluation cost per message', value=cost, inline=False)
+        embed.set_footer(text=f'Backtest took {elapsed:.1f} s')
+        return await ctx.send(embed=embed)
+
     @command(aliases=['killcount'])
     async def filterstats(self, ctx: Context):
         if not self.bot.is_admin(ctx.author):
@@ -267,6 +853,8 @@ class OnlyBans(Cog):
         deletes_per_day = self.bot.state["mod_deletes"] / (delete_delta / 86400)
 
         days_since_fp = math.floor((time_now - self.bot.state['mod_falsepositive_ts']) / 86400)
+        skip_rate = self.engine.skipped / (self.engine.searches or 1) * 100
+        hit_rate = self.verdicts.hits / ((self.verdicts.hits + self.verdicts.misses) or 1) * 100
 
         message = [
             f'- Total deletions: {self.bot.state["mod_deletes"]} ({deletes_per_day:.02f} per day)',
@@ -274,7 +862,22 @@ class OnlyBans(Cog):
             f'- Total bans: {self.bot.state["mod_bans"]} ({bans_per_day:.02f} per day)',
             f'- Times faster than Dyno: {self.bot.state["mod_faster"]}',
             f'- Days since last false-positive: {days_since_fp:d}',
+            f'- Prefilter skip rate: {skip_rate:.1f}% of {self.engine.searches} messages '
+            f'({self.engine.unconditional} filters are always evaluated, {len(self.engine.engines)} filter scopes)',
+            f'- Verdict cache hit rate: {hit_rate:.1f}% of {self.verdicts.hits + self.verdicts.misses} messages '
+            f'({len(self.verdicts)} cached)',
+            f'- Moderation queue: {self.actions.pending} pending actions, {self.actions.deletes} messages deleted '
+            f'in {self.actions.bulk_deletes} bulk deletes',
+            f'- Moderation log: {self.modlog.sent} messages sent, {self.modlog.merged} matches merged',
+            f'- Domain blocklist: {len(self.blocked_domains)} domains, {self.domain_matches} matches',
+            f'- Image blocklist: {len(self.image_tree)} images, {self.image_matches} matches, '
+            f'{self.image_hashes.hits} of {self.image_hashes.hits + self.image_hashes.misses} attachments cached',
         ]
+        if self.raid_detector is not None:
+            message.append(
+                f'- Raid detector: {self.raid_detector.flagged} of {self.raid_detector.checked} messages flagged '
+                f'({len(self.raid_detector)} in window)'
+            )
         return await ctx.send('\n'.join(message))
 
     @command()
@@ -295,26 +898,256 @@ class OnlyBans(Cog):
         self.bot.state['mod_falsepositive_ts'] = now
         await ctx.send(f'Clock was reset after {delta_days:.0f} days {delta_hours:.0f} hours.')
 
-    async def run_message_filters(self, msg: Message) -> bool:
+    @staticmethod
+    def scope_ids(msg: Message):
+        """
+        Returns (channel ids, role ids) that filter scopes are matched against: the channel, the parent channel
+        of a thread, their category and the author's roles
+        """
+        channel = msg.channel
+        channel_ids = [channel.id]
+        if isinstance(channel, Thread):
+            channel_ids.append(channel.parent_id)
+            channel = channel.parent
+        if category_id := getattr(channel, 'category_id', None):
+            channel_ids.append(category_id)
+        return tuple(channel_ids), [role.id for role in getattr(msg.author, 'roles', ())]
+
+    async def search(self, msg: Message):
+        """Evaluate filters for msg in the worker, quarantines filters that exceed the time budget on their own"""
+        text = normalize_message(msg.content)
+        # filters that are also matched against the raw text can give different verdicts for the same normalized text
+        digest = VerdictCache.key(msg.content)
+        channel_ids, role_ids = self.scope_ids(msg)
+        for _ in range(2):
+            self.engine.prepare()
+            generation = self.engine.generation
+            # the same message can get a different verdict elsewhere
+            scopes = self.engine.resolve(channel_ids, role_ids)
+            key = (digest, scopes)
+            found, verdict = self.verdicts.lookup(key, generation)
+            if found:
+                return verdict
+
+            if self.stats_sample_interval and self.engine.searches % self.stats_sample_interval == 0:
+                self.bot.loop.create_task(self.sample_costs(text, msg.content))
+            try:
+                verdict = await self.bot.loop.run_in_executor(
+                    self.executor, self.engine.search, text, self.time_budget, scopes, msg.content
+                )
+                self.verdicts.store(key, generation, verdict)
+                return verdict
+            except FilterTimeout as e:
+                if not e.names:
+                    # all filters combined were too slow for this (probably very long) message, but none on its own
+                    logger.warning(f'Filters exceeded time budget for message {msg.id} ({len(msg.content)} chars)')
+                    return None
+                for name in e.names:
+                    await self.quarantine(name, msg)
+        return None
+
+    async def quarantine(self, name, msg: Message):
+        if name not in self.filters:
+            return
+        pattern = self.filters[name].pattern
+        self.bot.state['filter_quarantine'] = {**self.quarantined, name: pattern}
+        self.update_engine(name)
+        logger.warning(f'Quarantined filter "{name}", it exceeded the time budget on message {msg.id}')
+
+        if not self.log_channel:
+            return
+        embed = Embed(
+            colour=0xC90000,
+            title='Filter quarantined',
+            description=f'Filter `{name}` took longer than {self.time_budget * 1000:.0f} ms on a message by '
+            f'{msg.author.mention} in {msg.channel.mention} and has been disabled until its regex is changed.',
+        )
+        embed.set_footer(text=f'Message ID: {msg.id}')
+        embed.add_field(name='Filter regex', value=f'`{pattern}`', inline=False)
+        embed.add_field(name='Message length', value=f'{len(msg.content)} characters', inline=False)
+        self.modlog.post(embed)
+
+    def is_exempt(self, msg: Message) -> bool:
         if not self.filtering_enabled:
-            return False
+            return True
         # check if channel is in private (these are ignored)
         if self.bot.is_private(msg.channel):
-            return False
+            return True
         if self.bot.is_supporter(msg.author):
+            return True
+        return False
+
+    async def run_message_filters(self, msg: Message) -> bool:
+        if self.is_exempt(msg):
+            return False
+
+        # bannable rules take precedence, then kickable, then just delete
+        result = await self.search(msg)
+        self.run_shadow_filters(msg)
+        if not result:
+            return False
+        name, regex, m = result
+        stats = self.stats.setdefault(name, FilterStats())
+        stats.record_match()
+        punishment = 'ban' if name in self.bannable else 'kick' if name in self.kickable else 'none'
+        fields = [
+            ('Filter name', f'`{name}`'),
+            ('Filter regex', f'`{regex.pattern}`'),
+            ('Regex match', f'`{m.group()}`'),
+        ]
+        # filtering the next message must not wait for the REST calls
+        self.bot.loop.create_task(self.enforce(msg, name, fields, punishment, stats))
+        return True
+
+    def run_shadow_filters(self, msg: Message):
+        """Evaluate shadow filters for msg in the background"""
+        if not len(self.shadow_engine):
+            return
+        if self._shadow_pending >= self.shadow_queue_limit:
+            self.shadow_skipped += 1
+            return
+        self._shadow_pending += 1
+        self.bot.loop.create_task(self._run_shadow_filters(msg, self.shadow_engine.resolve(*self.scope_ids(msg))))
+
+    async def _run_shadow_filters(self, msg: Message, scopes):
+        try:
+            results = await self.bot.loop.run_in_executor(
+                self.shadow_executor,
+                self.shadow_engine.evaluate,
+                normalize_message(msg.content),
+                self.time_budget,
+                scopes,
+                msg.content,
+            )
+        finally:
+            self._shadow_pending -= 1
+
+        for name, _, m, seconds in results:
+            if not (stats := self.stats.get(name)):
+                continue
+            stats.record_cost(seconds)
+            if not m:
+                continue
+            stats.record_match()
+            self.shadow_hits[name] += 1
+            if len(samples := self.shadow_samples[name]) < 3:
+                samples.append(f'{msg.channel.mention}: `{m.group()[:100]}` in "{msg.content[:150]}"')
+
+    @tasks.loop(hours=6.0)
+    async def shadow_digest(self):
+        # nothing to report right after starting
+        if self.shadow_digest.current_loop == 0 or not self.shadow:
+            return
+
+        fields = []
+        for name in sorted(self.shadow):
+            punishment = 'ban' if name in self.bannable else 'kick' if name in self.kickable else 'delete'
+            stats = self.stats.setdefault(name, FilterStats())
+            value = [f'{self.shadow_hits[name]} matches ({stats.summary()})']
+            value.extend(self.shadow_samples[name])
+            fields.append((f'{name} (would {punishment})', '\n'.join(value)[:1024]))
+        footer = None
+        if self.shadow_skipped:
+            footer = f'{self.shadow_skipped} messages were skipped because the shadow worker was busy'
+
+        self.shadow_hits.clear()
+        self.shadow_samples.clear()
+        self.shadow_skipped = 0
+        # every filter has a field of up to 1024 characters, the digest is split over several embeds if necessary
+        for embed in paginate_fields(
+            'Shadow filter digest', fields, description='Would-be matches since the last digest:', footer=footer
+        ):
+            self.modlog.post(embed)
+
+    async def run_domain_filters(self, msg: Message) -> bool:
+        if not len(self.blocked_domains) or self.is_exempt(msg):
+            return False
+
+        # look-alike characters are only mapped to their Latin form for the normalized text, but homograph domains
+        # are blocked by their punycode form, which only the host names as sent have
+        hosts = extract_hosts(msg.content)
+        if (text := normalize_message(msg.content)) != msg.content:
+            hosts |= extract_hosts(text)
+        matches = [(host, entry) for host in hosts if (entry := self.blocked_domains.match(host))]
+        if not matches:
             return False
 
-        # go through bannable rules first, then kickable, then just delete
-        for name, regex in self.sorted_filters:
-            m = regex.search(msg.content)
-            if m:
-                break
-        else:  # no filter match
+        # the harshest punishment wins if several blocked domains are mentioned
+        host, (domain, punishment) = max(matches, key=lambda match: _punishments.index(match[1][1]))
+        self.domain_matches += 1
+        fields = [('Blocked domain', f'`{domain}`'), ('Host', f'`{host}`')]
+        self.bot.loop.create_task(self.enforce(msg, domain, fields, punishment, matched='domain blocklist'))
+        return True
+
+    def run_image_filters(self, msg: Message) -> bool:
+        """
+        Attachments whose hash is cached (e.g. reposts during a spam wave) are checked right away. The others are
+        downloaded and checked in the background, the message is dispatched without waiting for the CDN.
+        """
+        if not msg.attachments or not len(self.image_tree) or self.is_exempt(msg):
+            return False
+
+        pending = []
+        for attachment in msg.attachments:
+            if not (attachment.content_type or '').startswith('image/') or attachment.size > self.image_max_size:
+                continue
+            key = HashCache.key(attachment.url)
+            found, image_hash = self.image_hashes.lookup(key)
+            if not found:
+                pending.append((attachment, key))
+            elif image_hash is not None and self.match_image(msg, attachment, image_hash):
+                return True
+        if pending:
+            self.bot.loop.create_task(self.check_attachments(msg, pending))
+        return False
+
+    async def check_attachments(self, msg: Message, attachments):
+        for attachment, key in attachments:
+            image_hash = await self.hash_attachment(attachment, key)
+            if image_hash is not None and self.match_image(msg, attachment, image_hash):
+                return
+
+    def match_image(self, msg: Message, attachment, image_hash) -> bool:
+        if not (matches := self.image_tree.search(image_hash, self.image_max_distance)):
             return False
 
+        distance, name = matches[0]
+        self.image_matches += 1
+        fields = [
+            ('Blocked image', f'`{name}`'),
+            ('Attachment', f'`{attachment.filename}`'),
+            ('Hash distance', f'{distance} of 64 bits'),
+        ]
+        punishment = self.image_punishments.get(name, 'none')
+        self.bot.loop.create_task(self.enforce(msg, name, fields, punishment, matched='image blocklist'))
+        return True
+
+    async def hash_attachment(self, attachment, key):
+        """Downloads and hashes attachment and caches the hash under key, None if it can't be downloaded or decoded"""
+        async with self.image_downloads:
+            try:
+                data = await attachment.read()
+            except Exception as e:
+                logger.warning(f'Downloading attachment {attachment.id} failed: {e!r}')
+                return None
+            try:
+                image_hash = await self.bot.loop.run_in_executor(self.image_executor, dhash, data)
+            except Exception as e:
+                logger.debug(f'Hashing attachment {attachment.id} failed: {e!r}')
+                image_hash = None
+        self.image_hashes.store(key, image_hash)
+        return image_hash
+
+    async def enforce(self, msg: Message, name, fields, punishment='none', stats: FilterStats = None, matched='filter'):
+        """
+        Delete message, punish author ('none', 'kick' or 'ban') and log it.
+        fields are (name, value) pairs describing the match, stats (of the matching filter) count the outcome.
+        """
         try:
-            await msg.delete()
+            await self.actions.delete(msg)
             deleted = 'Yes'
+            if stats is not None:
+                stats.record_outcome('deletes')
             self.bot.state['mod_faster'] += 1
         except Exception as e:
             deleted = f'No, failed with error: {e!r}'
@@ -326,19 +1159,24 @@ class OnlyBans(Cog):
         embed = Embed(
             colour=0xC90000,  # title='Message Filter Match',
             description=f'**Message by** {msg.author.mention} **in** '
-            f'{msg.channel.mention} **matched filter:**\n'
+            f'{msg.channel.mention} **matched {matched}:**\n'
             f'```\n{msg.content}\n```',
         )
         embed.set_footer(text=f'Message ID: {msg.id}')
-        embed.add_field(name='Filter name', value=f'`{name}`', inline=True)
-        embed.add_field(name='Filter regex', value=f'`{regex.pattern}`', inline=True)
-        embed.add_field(name='Regex match', value=f'`{m.group()}`', inline=True)
+        for field_name, value in fields:
+            embed.add_field(name=field_name, value=value, inline=True)
         embed.add_field(name='Message deleted?', value=deleted)
 
-        if name in self.bannable:
+        reason = f'Filter rule "{name}" matched.' if matched == 'filter' else f'Matched {matched} entry "{name}".'
+        if punishment == 'ban':
+            if (task := self.actions.ban(msg.author, delete_message_days=1, reason=reason)) is None:
+                embed.add_field(name='User banned?', value='Already being banned for another message')
+                return self.log_match(msg, name, embed, len(fields))
             try:
-                await msg.author.ban(delete_message_days=1, reason=f'Filter rule "{name}" matched.')
+                await task
                 embed.add_field(name='User banned?', value='Yes')
+                if stats is not None:
+                    stats.record_outcome('bans')
                 self.bot.state['mod_bans'] += 1
                 if not self.bot.state['mod_first_ban']:
                     self.bot.state['mod_first_ban'] = time.time()
@@ -346,11 +1184,16 @@ class OnlyBans(Cog):
                 logger.warning(f'Banning user {msg.author} failed: {e!r}')
                 embed.add_field(name='User banned?', value=f'No, failed with error: {e!r}')
             else:
-                logger.info(f'Banned user {msg.author.id}; Message {msg.id} matched filter "{name}"')
-        elif name in self.kickable:
+                logger.info(f'Banned user {msg.author.id}; Message {msg.id} matched {matched} "{name}"')
+        elif punishment == 'kick':
+            if (task := self.actions.kick(msg.author, reason=reason)) is None:
+                embed.add_field(name='User kicked?', value='Already being kicked for another message')
+                return self.log_match(msg, name, embed, len(fields))
             try:
-                await msg.author.kick(reason=f'Filter rule "{name}" matched.')
+                await task
                 embed.add_field(name='User kicked?', value='Yes')
+                if stats is not None:
+                    stats.record_outcome('kicks')
                 self.bot.state['mod_kicks'] += 1
                 if not self.bot.state['mod_first_kick']:
                     self.bot.state['mod_first_kick'] = time.time()
@@ -358,21 +1201,67 @@ class OnlyBans(Cog):
                 logger.warning(f'Banning user {msg.author} failed: {e!r}')
                 embed.add_field(name='User kicked?', value=f'No, failed with error: {e!r}')
             else:
-                logger.info(f'Kicked user {msg.author.id}; Message {msg.id} matched filter "{name}"')
+                logger.info(f'Kicked user {msg.author.id}; Message {msg.id} matched {matched} "{name}"')
         else:
-            logger.info(f'Deleted message by {msg.author.id}; Message {msg.id} matched filter "{name}"')
+            logger.info(f'Deleted message by {msg.author.id}; Message {msg.id} matched {matched} "{name}"')
 
-        await self.log_channel.send(embed=embed)
-        return True
+        self.log_match(msg, name, embed, len(fields))
+
+    def log_match(self, msg: Message, name, embed: Embed, skip=3):
+        """
+        Post to the log channel, during bursts matches of the same filter and user are merged into one embed.
+        The fields after the first `skip` ones (that describe the match) are listed for every merged match.
+        """
+        outcome = ', '.join(f'{field.name} {field.value}' for field in embed.fields[skip:])
+        self.modlog.post(embed, key=(name, msg.author.id), note=f'{msg.channel.mention} `{msg.id}` - {outcome}')
+
+    async def check_raid(self, msg: Message):
+        if self.raid_detector is None or not self.filtering_enabled or not msg.guild:
+            return
+        if self.bot.is_private(msg.channel) or self.bot.is_supporter(msg.author):
+            return
+        if not (
+            result := self.raid_detector.check(
+                msg.guild.id, msg.channel.id, msg.author.id, normalize_message(msg.content)
+            )
+        ):
+            return
+
+        kind, description, user_ids = result
+        key = (kind,) if kind in ('guild_rate', 'duplicate_users') else (kind, msg.author.id)
+        if self.raid_alerts.is_limited(*key):
+            return
+        logger.warning(f'Possible raid/spam wave: {description} (message {msg.id} by {msg.author.id})')
+        if not self.log_channel:
+            return
+
+        embed = Embed(
+            colour=0xE67E22,
+            title='Possible raid or spam wave',
+            description=f'**{description}**, latest message by {msg.author.mention} in {msg.channel.mention}:\n'
+            f'```\n{msg.content[:1000]}\n```',
+        )
+        embed.set_footer(text=f'Message ID: {msg.id}')
+        if user_ids:
+            embed.add_field(name='Accounts', value=' '.join(f'<@{user_id}>' for user_id in sorted(user_ids)))
+        self.modlog.post(embed)
 
     @Cog.listener()
     async def on_message(self, msg: Message):
         if msg.author == self.bot.user:
             return
+        if msg.guild and not msg.author.bot and not self.bot.is_private(msg.channel):
+            self.corpus.add(msg.content)
         # if any filters hit, do not forward the message
         if await self.run_message_filters(msg):
             return
+        if await self.run_domain_filters(msg):
+            return
+        if self.run_image_filters(msg):
+            return
+        await self.check_raid(msg)
 
+        # listeners can get the text the filters saw from normalize_message(msg.content) without normalizing it again
         self.bot.dispatch('filtered_message', msg)
 
 
@@ -382,5 +1271,7 @@ def setup(bot):
         mot = OnlyBans(bot, bot.config['onlybans'])
         bot.add_cog(mot)
         bot.loop.create_task(mot.fetch_filters())
+        mot.stats_flusher.start()
+        mot.shadow_digest.start()
     else:
         logger.info('moderation cog not enabled.')
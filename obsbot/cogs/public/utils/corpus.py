@@ -0,0 +1,158 @@
+import logging
+import os
+import re
+import time
+import zlib
+
+from collections import Counter, deque
+
+from .normalize import normalization_sensitive
+from .stats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# <sequence number>-<number of messages>.z
+_chunk_file_re = re.compile(r'(\d+)-(\d+)\.z')
+
+
+class MessageCorpus:
+    """
+    Rolling corpus of recent messages, e.g. for backtesting filters.
+
+    Messages are collected in chunks of `chunk_size` that are compressed (and written to a file in `path`, if set)
+    once full. The oldest chunks are dropped to keep the compressed size below `max_bytes`.
+    """
+
+    def __init__(self, path=None, max_bytes=16 << 20, chunk_size=500):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        # (sequence number, number of messages, compressed data), oldest first
+        self._chunks = deque()
+        self._current = []
+        self._size = 0
+        self._seq = 0
+        if path:
+            self._load()
+
+    def __len__(self):
+        return sum(count for _, count, _ in self._chunks) + len(self._current)
+
+    @property
+    def size(self):
+        """Compressed size in bytes"""
+        return self._size
+
+    def _filename(self, seq, count):
+        return os.path.join(self.path, f'{seq:08d}-{count}.z')
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        for filename in sorted(os.listdir(self.path)):
+            if not (m := _chunk_file_re.fullmatch(filename)):
+                continue
+            with open(os.path.join(self.path, filename), 'rb') as f:
+                data = f.read()
+            self._chunks.append((int(m.group(1)), int(m.group(2)), data))
+            self._size += len(data)
+        if self._chunks:
+            self._seq = self._chunks[-1][0] + 1
+        self._evict()
+        logger.info(f'Loaded message corpus with {len(self)} messages ({self._size / 1024:.0f} KiB).')
+
+    def add(self, text):
+        if not text:
+            return
+        # NUL separates messages in compressed chunks
+        self._current.append(text.replace('\0', ''))
+        if len(self._current) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Compress (and write) the current chunk, even if it is not full"""
+        if not self._current:
+            return
+        data = zlib.compress('\0'.join(self._current).encode('utf-8', 'surrogatepass'))
+        seq, count = self._seq, len(self._current)
+        self._chunks.append((seq, count, data))
+        self._size += len(data)
+        self._seq += 1
+        self._current = []
+
+        if self.path:
+            try:
+                with open(self._filename(seq, count), 'wb') as f:
+                    f.write(data)
+            except OSError as e:
+                logger.error(f'Writing message corpus chunk failed: {e!r}')
+        self._evict()
+
+    def _evict(self):
+        while self._chunks and self._size > self.max_bytes:
+            seq, count, data = self._chunks.popleft()
+            self._size -= len(data)
+            if self.path:
+                try:
+                    os.remove(self._filename(seq, count))
+                except OSError as e:
+                    logger.warning(f'Removing message corpus chunk failed: {e!r}')
+
+    def snapshot(self):
+        """Returns a snapshot that messages() can iterate over in another thread"""
+        return [data for _, _, data in self._chunks], list(self._current)
+
+    @staticmethod
+    def messages(snapshot):
+        chunks, current = snapshot
+        for data in chunks:
+            yield from zlib.decompress(data).decode('utf-8', 'surrogatepass').split('\0')
+        yield from current
+
+
+class BacktestResult:
+    __slots__ = ('messages', 'matches', 'samples', 'caught', 'overlap', 'timeouts', 'latency')
+
+    def __init__(self):
+        self.messages = 0
+        self.matches = 0
+        # [(message, matched text)]
+        self.samples = []
+        # matches that existing filters catch as well, and how often each of them does
+        self.caught = 0
+        self.overlap = Counter()
+        self.timeouts = 0
+        self.latency = LatencyHistogram()
+
+
+def backtest(messages, candidate, engine, timeout=None, exclude=None, samples=5, normalize=None) -> BacktestResult:
+    """
+    Run the candidate regex over messages, timing every search. Matches are also run through the existing filters
+    of engine (except the one named exclude, e.g. the filter the candidate would replace) to find the overlap.
+    Like live filtering, messages are searched after normalize() (if given), and as they are if the candidate
+    contains characters normalization changes.
+    """
+    result = BacktestResult()
+    check_raw = normalize is not None and normalization_sensitive(candidate.pattern)
+    for raw in messages:
+        text = normalize(raw) if normalize is not None else raw
+        result.messages += 1
+        start = time.perf_counter()
+        try:
+            m = candidate.search(text, timeout=timeout, concurrent=True)
+            if not m and check_raw and raw != text:
+                m = candidate.search(raw, timeout=timeout, concurrent=True)
+        except TimeoutError:
+            result.timeouts += 1
+            m = None
+        result.latency.record(time.perf_counter() - start)
+        if not m:
+            continue
+
+        result.matches += 1
+        if len(result.samples) < samples:
+            result.samples.append((raw, m.group()))
+        matches, _ = engine.search_all(text, timeout, raw)
+        if names := {name for name, _, _ in matches if name != exclude}:
+            result.caught += 1
+            result.overlap.update(names)
+    return result
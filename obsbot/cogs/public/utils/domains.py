@@ -0,0 +1,53 @@
+import re
+
+# runs of characters that can be part of a host name, with or without scheme (scam messages often omit it), also
+# separates the real host of URLs like "https://discord.com@example.com/". Hosts are validated per run, a pattern
+# for whole hosts like (?:[\w-]+\.)+[\w-]+ backtracks quadratically on long runs without a host in them
+_host_chars_re = re.compile(r'[\w.-]+')
+# empty labels split a run into several hosts
+_empty_labels_re = re.compile(r'\.{2,}')
+# hosts file lines ("0.0.0.0 example.com") and URLs are accepted when importing domains
+_hosts_file_re = re.compile(r'^(?:\d{1,3}(?:\.\d{1,3}){3}\s+)?(?:[a-z][a-z0-9+.-]*://)?([^/\s:?#]+)', re.IGNORECASE)
+
+
+def normalize_host(host):
+    """Lowercase host without trailing dot, with non-ASCII labels punycode-encoded like in blocklists"""
+    host = host.lower().strip('.')
+    if not host.isascii():
+        try:
+            host = host.encode('idna').decode('ascii')
+        except UnicodeError:
+            pass
+    return host
+
+
+def extract_hosts(text):
+    """Returns the normalized host names in text"""
+    # most messages contain no host at all
+    if '.' not in text:
+        return set()
+    hosts = set()
+    for run in _host_chars_re.findall(text):
+        if '.' not in run:
+            continue
+        for host in _empty_labels_re.split(run) if '..' in run else (run,):
+            host = host.strip('.')
+            # single labels, version numbers, IP addresses etc.
+            if '.' not in host or host.rsplit('.', 1)[1].isdigit():
+                continue
+            hosts.add(normalize_host(host))
+    return hosts
+
+
+def parse_domain_list(text):
+    """Domains listed in text, one per line; comments (#), hosts file entries and URLs are supported"""
+    domains = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line or not (m := _hosts_file_re.match(line)):
+            continue
+        domain = normalize_host(m.group(1))
+        # single labels (localhost) and IP addresses
+        if '.' in domain and not domain.rsplit('.', 1)[1].isdigit():
+            domains.append(domain)
+    return domains
@@ -0,0 +1,88 @@
+from typing import Iterable, Optional
+
+
+class Factoid:
+    """Compact factoid record, everything but the usage counter is treated as immutable"""
+
+    __slots__ = ('id', 'name', 'aliases', 'message', 'image_url', 'embed', 'uses')
+
+    def __init__(self, id, name, aliases, message, image_url, embed, uses):
+        self.id = id
+        self.name = name
+        self.aliases = aliases
+        self.message = message
+        self.image_url = image_url
+        self.embed = embed
+        self.uses = uses
+
+    @classmethod
+    def from_record(cls, record) -> 'Factoid':
+        return cls(
+            id=record['id'],
+            name=record['name'],
+            aliases=tuple(record['aliases']),
+            message=record['message'],
+            image_url=record['image_url'],
+            embed=record['embed'],
+            uses=record['uses'],
+        )
+
+    @property
+    def names(self):
+        return (self.name,) + self.aliases
+
+    def same_content(self, other: Optional['Factoid']) -> bool:
+        """Compare everything but the usage counter"""
+        if other is None:
+            return False
+        return all(getattr(self, attr) == getattr(other, attr) for attr in self.__slots__ if attr != 'uses')
+
+
+class FactoidStore:
+    """
+    Immutable snapshot of all factoids with a single lookup table for names and aliases.
+
+    Changes create a new snapshot that is swapped in with one assignment by the owner,
+    so readers never see a half-updated state.
+    """
+
+    __slots__ = ('factoids', 'lookup')
+
+    def __init__(self, factoids: Iterable[Factoid] = ()):
+        factoids = list(factoids)
+        self.factoids = {f.name: f for f in factoids}
+        # aliases first so a factoid name always takes precedence over a conflicting alias
+        self.lookup = {alias: f for f in factoids for alias in f.aliases}
+        self.lookup.update(self.factoids)
+
+    def __len__(self):
+        return len(self.factoids)
+
+    def __contains__(self, name):
+        return name in self.lookup
+
+    @property
+    def alias_count(self):
+        return len(self.lookup) - len(self.factoids)
+
+    def get(self, name) -> Optional[Factoid]:
+        """Get factoid by name or alias"""
+        return self.lookup.get(name)
+
+    def get_by_id(self, factoid_id) -> Optional[Factoid]:
+        """Get factoid by database id (linear scan, only for rare lookups like button clicks)"""
+        return next((f for f in self.factoids.values() if f.id == factoid_id), None)
+
+    def replace(self, name, factoid: Optional[Factoid] = None) -> 'FactoidStore':
+        """Returns new snapshot with factoid `name` removed and (optionally) `factoid` added in its place"""
+        store = FactoidStore.__new__(FactoidStore)
+        store.factoids = dict(self.factoids)
+        store.lookup = dict(self.lookup)
+
+        if old := store.factoids.pop(name, None):
+            for old_name in old.names:
+                store.lookup.pop(old_name, None)
+        if factoid:
+            store.factoids[factoid.name] = factoid
+            store.lookup.update((n, factoid) for n in factoid.names)
+        return store
@@ -0,0 +1,897 @@
+import hashlib
+import logging
+import re
+import time
+import warnings
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import regex
+
+from .stats import LatencyHistogram
+
+try:  # Python 3.11+
+    from re import _parser as sre_parse
+    from re._compiler import _EXTRA_CASES as _extra_cases
+except ImportError:
+    import sre_parse
+    from sre_compile import _ignorecase_fixes as _extra_cases
+
+logger = logging.getLogger(__name__)
+
+FILTER_FLAGS = re.IGNORECASE | re.DOTALL
+_default_flags = sre_parse.parse('', FILTER_FLAGS).state.flags
+_special_chars = frozenset('.^$*+?{}[]()|\\')
+_quantifiers = frozenset('*+?{')
+_repeats = tuple(op for op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') if hasattr(sre_parse, op))
+# shorter literals are too common to rule out messages
+_min_literal_length = 2
+
+_unbounded = sre_parse.MAXREPEAT
+
+# Punishment tiers, evaluated highest first
+TIER_DELETE = 0
+TIER_KICK = 1
+TIER_BAN = 2
+
+
+def _build_fold_table():
+    """
+    Case-insensitive matching treats some lowercase characters as equal (e.g. "s" and "ſ", or "ς" and "σ"),
+    these are mapped to one of them. "İ" also matches "i" but lowercases to "i" + U+0307, so the latter is dropped.
+    """
+    table = {0x307: None}
+    for char in _extra_cases:
+        group, stack = set(), [char]
+        while stack:
+            if (c := stack.pop()) not in group:
+                group.add(c)
+                stack.extend(_extra_cases.get(c, ()))
+        table.update((c, min(group)) for c in group if c != min(group))
+    return table
+
+
+_fold_table = _build_fold_table()
+
+
+def fold_case(text):
+    """Folds text so that anything a case-insensitive regex matches is a substring of the folded text"""
+    return text.lower().translate(_fold_table)
+
+
+class FilterError(ValueError):
+    """Raised for patterns that don't compile or are rejected by the backtracking check"""
+
+
+class FilterTimeout(Exception):
+    """Raised if evaluating a message exceeded its time budget, names are the filters that exceed it on their own"""
+
+    def __init__(self, names):
+        super().__init__(f'Filter evaluation timed out, slow filters: {", ".join(names) or "none"}')
+        self.names = names
+
+
+def compile_filter(pattern, check_risk=False) -> regex.Pattern:
+    """
+    Compile a filter with the regex module, which (unlike re) can abort a search after a timeout.
+    Raises FilterError if the pattern is invalid, or if check_risk is set and backtracking_risk() flags it.
+    """
+    try:
+        compiled = regex.compile(pattern, FILTER_FLAGS)
+    except regex.error as e:
+        raise FilterError(f'Compiling regex failed: {e}')
+    if check_risk and (risk := backtracking_risk(pattern)):
+        raise FilterError(f'Regex may backtrack catastrophically: {risk}')
+    return compiled
+
+
+def _parse(pattern):
+    """
+    Parse pattern for analysis, returns None for syntax only the regex module supports. That includes patterns re
+    parses differently from the regex module, e.g. nested/POSIX sets like "[[:alpha:]]" or set operations like
+    "[a--b]", which re only warns about (FutureWarning).
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        try:
+            parsed = sre_parse.parse(pattern, FILTER_FLAGS)
+        except (re.error, OverflowError):
+            return None
+    if any(issubclass(warning.category, FutureWarning) for warning in caught):
+        return None
+    return parsed
+
+
+# characters matched by categories ("\d", "\s", "\w" and their negations), for building example matches
+_category_examples = {
+    'CATEGORY_DIGIT': '0',
+    'CATEGORY_NOT_DIGIT': 'a',
+    'CATEGORY_SPACE': ' ',
+    'CATEGORY_NOT_SPACE': 'a',
+    'CATEGORY_WORD': 'a',
+    'CATEGORY_NOT_WORD': ' ',
+    'CATEGORY_LINEBREAK': '\n',
+    'CATEGORY_NOT_LINEBREAK': 'a',
+}
+
+
+def _example(parsed):
+    """
+    Returns a (short) text that the parsed pattern matches, or None for constructs that aren't supported, e.g.
+    negated sets, lookarounds or backreferences
+    """
+    parts = []
+    for op, av in parsed:
+        name = str(op)
+        if op is sre_parse.LITERAL:
+            parts.append(chr(av))
+        elif op is sre_parse.ANY:
+            parts.append('a')
+        elif op is sre_parse.AT:
+            # anchors and word boundaries, searching an example without them usually still matches
+            continue
+        elif op is sre_parse.IN:
+            first_op, first_av = av[0]
+            if first_op is sre_parse.LITERAL:
+                parts.append(chr(first_av))
+            elif first_op is sre_parse.RANGE:
+                parts.append(chr(first_av[0]))
+            elif first_op is sre_parse.CATEGORY and (char := _category_examples.get(str(first_av).replace('_UNI', ''))):
+                parts.append(char)
+            else:
+                return None
+        elif op is sre_parse.CATEGORY and (char := _category_examples.get(str(av).replace('_UNI', ''))):
+            parts.append(char)
+        elif op is sre_parse.SUBPATTERN or name == 'ATOMIC_GROUP':
+            if (part := _example(av[-1] if op is sre_parse.SUBPATTERN else av)) is None:
+                return None
+            parts.append(part)
+        elif name in _repeats:
+            if (part := _example(av[2])) is None:
+                return None
+            parts.append(part * av[0])
+        elif op is sre_parse.BRANCH:
+            if (part := _example(av[1][0])) is None:
+                return None
+            parts.append(part)
+        else:
+            return None
+    return ''.join(parts)
+
+
+def _consistent(pattern, parsed) -> bool:
+    """
+    Cross-check re's parse of pattern (which the analysis relies on) against the regex module filters are compiled
+    with: an example match built from the parse has to match with the regex module. False if it doesn't, patterns
+    for which no example can be built are trusted.
+    """
+    if (example := _example(parsed)) is None:
+        return True
+    try:
+        return regex.search(pattern, example, FILTER_FLAGS) is not None
+    except regex.error:
+        return False
+
+
+def _items(parsed):
+    """Yields all (opcode, argument) pairs in a parsed pattern, including nested ones"""
+    for op, av in parsed:
+        yield op, av
+        stack = [av]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, sre_parse.SubPattern):
+                yield from _items(item)
+            elif isinstance(item, (list, tuple)):
+                stack.extend(item)
+
+
+def _opcodes(parsed):
+    """Yields all opcodes in a parsed pattern, including nested ones"""
+    return (op for op, _ in _items(parsed))
+
+
+def _splittable(parsed) -> bool:
+    """
+    True if the text matched by repeating parsed can be split between the repetitions in more than one way,
+    i.e. it contains a variable-length repeat and everything else in it is optional, e.g. "a+" or "\\w+\\s?".
+    """
+    variable = False
+    for op, av in parsed:
+        if str(op) in ('MAX_REPEAT', 'MIN_REPEAT') and av[0] != av[1] and av[1] > 1:
+            variable = True
+            continue
+        if op is sre_parse.SUBPATTERN and _splittable(av[-1]):
+            variable = True
+            continue
+        if op is sre_parse.BRANCH and any(_splittable(branch) for branch in av[1]):
+            variable = True
+            continue
+        # possessive repeats and atomic groups never give back what they matched, so they count as required
+        if sre_parse.SubPattern(parsed.state, [(op, av)]).getwidth()[0]:
+            return False
+    return variable
+
+
+def backtracking_risk(pattern):
+    """
+    Returns a description of the first construct in pattern that can take exponential time to fail, or None.
+    Only nested quantifiers like "(a+)+" or "(\\w+\\s?)*" are detected, the time budget has to cover the rest.
+    """
+    if (parsed := _parse(pattern)) is None:
+        return None
+    for op, av in _items(parsed):
+        if str(op) in ('MAX_REPEAT', 'MIN_REPEAT') and av[1] == _unbounded and _splittable(av[2]):
+            return (
+                'an unbounded repeat contains a variable-length repeat (e.g. "(a+)+"), '
+                'use a possessive quantifier or atomic group or make the repetition unambiguous'
+            )
+    return None
+
+
+def can_combine(pattern) -> bool:
+    """Backreferences, named groups and global inline flags only work if the pattern is compiled on its own"""
+    if (parsed := _parse(pattern)) is None or not _consistent(pattern, parsed):
+        return False
+    if parsed.state.groupdict or parsed.state.flags != _default_flags:
+        return False
+    return not any(str(op).startswith('GROUPREF') for op in _opcodes(parsed))
+
+
+def _required(parsed):
+    """Returns a set of strings of which (at least) one is part of every match of the parsed pattern, or None"""
+    best = None
+    run = []
+
+    def consider(candidate):
+        nonlocal best
+        if candidate and (not best or min(map(len, candidate)) > min(map(len, best))):
+            best = candidate
+
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        consider({''.join(run)} if run else None)
+        run = []
+
+        if op is sre_parse.SUBPATTERN:
+            consider(_required(av[-1]))
+        elif op is sre_parse.ASSERT:
+            # lookarounds don't consume the text but it still has to contain it
+            consider(_required(av[1]))
+        elif str(op) in _repeats and av[0] >= 1:
+            consider(_required(av[2]))
+        elif str(op) == 'ATOMIC_GROUP':
+            consider(_required(av))
+        elif op is sre_parse.BRANCH:
+            branches = [_required(branch) for branch in av[1]]
+            if all(branches):
+                consider(set().union(*branches))
+
+    consider({''.join(run)} if run else None)
+    return best
+
+
+def required_literals(pattern):
+    """
+    Returns the case-folded literals of which at least one appears in any text that the pattern (compiled with
+    FILTER_FLAGS) matches, e.g. r'free\\s*(nitro|steam)' -> {'nitro', 'steam'}. Returns None if there are none.
+    """
+    if (parsed := _parse(pattern)) is None:
+        return None
+    literals = _required(parsed)
+    if not literals or min(map(len, literals)) < _min_literal_length:
+        return None
+    literals = frozenset(fold_case(literal) for literal in literals)
+    # an example match must contain one of the literals, and the regex module has to agree that it matches
+    if (example := _example(parsed)) is not None:
+        if not _consistent(pattern, parsed) or not any(literal in fold_case(example) for literal in literals):
+            return None
+    return literals
+
+
+def split_branches(pattern):
+    """Split pattern at its top-level "|" (if any), e.g. 'foo|ba(r|z)' -> ['foo', 'ba(r|z)']"""
+    branches = []
+    depth = pos = start = 0
+    in_class = False
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == '\\':
+            pos += 1
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # "]" directly after "[" or "[^" is a literal
+            if pattern[pos + 1 : pos + 2] == '^':
+                pos += 1
+            if pattern[pos + 1 : pos + 2] == ']':
+                pos += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and not depth:
+            branches.append(pattern[start:pos])
+            start = pos + 1
+        pos += 1
+    branches.append(pattern[start:])
+    return branches
+
+
+def split_prefix(pattern):
+    """
+    Split a pattern (without top-level "|") into the tokens it has to start with and the remaining pattern,
+    e.g. r'\\bfree\\s+nitro' -> (['\\\\b', 'f', 'r', 'e', 'e'], r'\\s+nitro'). Tokens are literal characters
+    (escaped and case-folded) or word boundaries, the prefix is empty if the pattern can't be split.
+    """
+    tokens = []
+    literals = []
+    pos = 0
+    while pos < len(pattern):
+        char, width = pattern[pos], 1
+        if pattern.startswith('\\b', pos):
+            char, width = None, 2
+        elif char == '\\' and pos + 1 < len(pattern) and not pattern[pos + 1].isalnum():
+            char, width = pattern[pos + 1], 2
+        elif char in _special_chars:
+            break
+        # a quantified character is not required
+        if pattern[pos + width : pos + width + 1] in _quantifiers:
+            break
+        tokens.append('\\b' if char is None else re.escape(_fold(char)))
+        literals.append('\\b' if char is None else re.escape(char))
+        pos += width
+
+    rest = pattern[pos:]
+    # sanity check, the split must not change what the pattern means
+    original = _parse(pattern)
+    recombined = _parse(''.join(literals) + rest)
+    if original is None or recombined is None or repr(original.data) != repr(recombined.data):
+        return [], pattern
+    return tokens, rest
+
+
+def _fold(char):
+    folded = char.lower()
+    return folded if len(folded) == 1 else char
+
+
+def _trie_pattern(node):
+    alternatives = [token + _trie_pattern(child) for token, child in node.items() if token is not None]
+    alternatives.extend(node.get(None, ()))
+    return alternatives[0] if len(alternatives) == 1 else '(?:{})'.format('|'.join(alternatives))
+
+
+class FilterStats:
+    """Match/punishment counters and sampled evaluation cost of one filter, persisted in the filters table"""
+
+    __slots__ = ('matches', 'deletes', 'kicks', 'bans', 'last_match', 'latency', 'dirty')
+
+    def __init__(self, row=None):
+        row = row or dict()
+        self.matches = row.get('matches') or 0
+        self.deletes = row.get('deletes') or 0
+        self.kicks = row.get('kicks') or 0
+        self.bans = row.get('bans') or 0
+        self.last_match = row.get('last_match')
+        # time it takes to run the filter on its own, only measured for a sample of messages
+        self.latency = LatencyHistogram.restore(row.get('eval_buckets'), row.get('eval_time'), row.get('eval_max'))
+        # changed since the last time it was persisted
+        self.dirty = False
+
+    def record_match(self):
+        self.matches += 1
+        self.last_match = datetime.now(timezone.utc)
+        self.dirty = True
+
+    def record_outcome(self, outcome):
+        """Count a successful punishment, outcome is the name of its counter (deletes, kicks or bans)"""
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        self.dirty = True
+
+    def record_cost(self, seconds):
+        self.latency.record(seconds)
+        self.dirty = True
+
+    def reset_cost(self):
+        self.latency = LatencyHistogram()
+        self.dirty = True
+
+    def values(self):
+        """Values for the stats columns in the order of the table"""
+        return (
+            self.matches,
+            self.deletes,
+            self.kicks,
+            self.bans,
+            self.last_match,
+            self.latency.total,
+            self.latency.max,
+            self.latency.buckets,
+        )
+
+    def summary(self):
+        parts = [f'{self.matches} hits']
+        outcomes = ((self.deletes, 'deleted'), (self.kicks, 'kicked'), (self.bans, 'banned'))
+        parts.extend(f'{n} {outcome}' for n, outcome in outcomes if n)
+        if self.last_match:
+            parts.append(f'last {self.last_match:%Y-%m-%d}')
+        if self.latency.count:
+            p95 = self.latency.percentile(0.95)
+            parts.append(f'p95 {p95 * 1000:.1f} ms' if p95 >= 0.001 else f'p95 {p95 * 1_000_000:.0f} µs')
+        return ', '.join(parts)
+
+
+class VerdictCache:
+    """
+    Bounded LRU of message hash -> filter verdict (result of FilterEngine.search), so that repeated messages
+    (e.g. the same spam posted hundreds of times during a raid) don't have to be evaluated again.
+    Entries are only valid for the engine generation they were computed with, the cache is cleared when it changes.
+    """
+
+    def __init__(self, size=4096):
+        self.cache = OrderedDict()
+        self.size = size
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    @staticmethod
+    def key(text):
+        return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    def _check_generation(self, generation):
+        if generation != self.generation:
+            self.cache.clear()
+            self.generation = generation
+
+    def lookup(self, key, generation):
+        """Returns (True, verdict) if key is cached for this generation, (False, None) otherwise"""
+        self._check_generation(generation)
+        if key not in self.cache:
+            self.misses += 1
+            return False, None
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return True, self.cache[key]
+
+    def store(self, key, generation, verdict):
+        self._check_generation(generation)
+        self.cache[key] = verdict
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+
+class _TierTimeout(Exception):
+    def __init__(self, filters):
+        super().__init__()
+        # name -> regex of the filters that were running
+        self.filters = filters
+
+
+class _Filter:
+    __slots__ = ('regex', 'branches', 'literals')
+
+    def __init__(self, regex: regex.Pattern):
+        self.regex = regex
+        # [(prefix tokens, remaining pattern) per top-level branch], empty if the filter can't be combined
+        self.branches = []
+        if can_combine(regex.pattern):
+            self.branches = [split_prefix(branch) for branch in split_branches(regex.pattern)]
+            # every branch needs a literal prefix, otherwise it would have to be tried at every position
+            if not all(any(token != '\\b' for token in tokens) for tokens, _ in self.branches):
+                self.branches = []
+        # None if the filter has to be evaluated for every message
+        self.literals = required_literals(regex.pattern)
+
+
+def _remaining(deadline):
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+
+class _Tier:
+    __slots__ = ('filters', 'state', 'dirty')
+
+    def __init__(self):
+        # name -> _Filter
+        self.filters = dict()
+        # what searches use, replaced as a whole by build() so that searches in other threads see a consistent state:
+        # (combined regex, {group name: (filter name, regex)}, names of combined filters (None if one of them has
+        #  no required literals), [(name, _Filter)] of filters evaluated separately)
+        self.state = (None, dict(), None, [])
+        self.dirty = False
+
+    def build(self):
+        """
+        Combine filters into one regex with a trie of their (case-folded) literal prefixes, e.g. "free\\s*nitro" and
+        "freebies" become "fre(?:e(?:(?P<f0>\\s*nitro)|b(?:i(?:e(?:s(?P<f1>))))))". Python's regex engines try every
+        alternative at every position, so this only pays off because mismatching prefixes are rejected early.
+        """
+        trie = dict()
+        groups = dict()
+        combined_literals = set()
+        standalone = []
+        for name, _filter in self.filters.items():
+            if not _filter.branches:
+                standalone.append((name, _filter))
+                continue
+            for tokens, rest in _filter.branches:
+                node = trie
+                for token in tokens:
+                    node = node.setdefault(token, dict())
+                group = f'f{len(groups)}'
+                node.setdefault(None, []).append(f'(?P<{group}>{rest})')
+                groups[group] = (name, _filter.regex)
+            if _filter.literals is None:
+                combined_literals = None
+            elif combined_literals is not None:
+                combined_literals.add(name)
+
+        try:
+            combined = regex.compile(_trie_pattern(trie), FILTER_FLAGS) if trie else None
+        except regex.error as e:
+            logger.error(f'Compiling combined filters failed with: {e}, falling back to evaluating them separately')
+            combined, groups, standalone = None, dict(), list(self.filters.items())
+        self.state = (combined, groups, combined_literals, standalone)
+        self.dirty = False
+        logger.debug(f'Combined {len(groups)} filters, {len(standalone)} are evaluated separately')
+
+    def search(self, text, candidates, deadline=None):
+        """
+        Search text with all filters that either have to be evaluated always or are in candidates.
+        Raises _TierTimeout with the filters that were being evaluated if deadline passes.
+        """
+        combined, groups, combined_literals, standalone = self.state
+        if combined and (combined_literals is None or not combined_literals.isdisjoint(candidates)):
+            try:
+                m = combined.search(text, timeout=_remaining(deadline), concurrent=True)
+            except TimeoutError:
+                raise _TierTimeout(dict(groups.values()))
+            if m:
+                name, _regex = groups[m.lastgroup]
+                return name, _regex, m
+        for name, _filter in standalone:
+            if _filter.literals is not None and name not in candidates:
+                continue
+            try:
+                m = _filter.regex.search(text, timeout=_remaining(deadline), concurrent=True)
+            except TimeoutError:
+                raise _TierTimeout({name: _filter.regex})
+            if m:
+                return name, _filter.regex, m
+        return None
+
+
+class FilterEngine:
+    """
+    Evaluates message filters with one combined regex per punishment tier instead of one search per filter.
+
+    Filters that have required literals are only evaluated if one of them appears in the message, which is checked
+    with a single scan over all literals first.
+
+    Within a tier the filter matching first in the text is reported. Changing a filter only marks its tier
+    for a rebuild, which happens in prepare(). Searches only read the state prepare() built, so they can run
+    in a worker thread while filters are changed.
+    """
+
+    def __init__(self):
+        self._tiers = {tier: _Tier() for tier in (TIER_BAN, TIER_KICK, TIER_DELETE)}
+        # name -> tier
+        self._filter_tiers = dict()
+        # required literal -> names of filters that need it
+        self._literals = dict()
+        # (scanner regex, ((literal, names), ...)), replaced as a whole like the tier state
+        self._scanner = (None, ())
+        self._scanner_dirty = False
+        # prefilter stats, number of messages searched and those for which only filters without literals were run
+        self.searches = 0
+        self.skipped = 0
+        # changes whenever a filter is added, changed or removed, e.g. to invalidate cached verdicts
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._filter_tiers)
+
+    @property
+    def unconditional(self):
+        """Number of filters that can't be skipped by the prefilter"""
+        return sum(f.literals is None for tier in self._tiers.values() for f in tier.filters.values())
+
+    def set(self, name, regex: regex.Pattern, tier=TIER_DELETE):
+        """Add or replace a filter"""
+        self.remove(name)
+        self._tiers[tier].filters[name] = _filter = _Filter(regex)
+        self._tiers[tier].dirty = True
+        self._filter_tiers[name] = tier
+        for literal in _filter.literals or ():
+            self._literals.setdefault(literal, set()).add(name)
+        self._scanner_dirty = True
+        self.generation += 1
+
+    def remove(self, name):
+        if (tier := self._filter_tiers.pop(name, None)) is None:
+            return
+        _filter = self._tiers[tier].filters.pop(name)
+        self._tiers[tier].dirty = True
+        for literal in _filter.literals or ():
+            self._literals[literal].discard(name)
+            if not self._literals[literal]:
+                del self._literals[literal]
+        self._scanner_dirty = True
+        self.generation += 1
+
+    def prepare(self):
+        """Rebuild whatever changed since the last call, has to be called before searching"""
+        for tier in self._tiers.values():
+            if tier.dirty:
+                tier.build()
+        if self._scanner_dirty:
+            self._build_scanner()
+
+    def _build_scanner(self):
+        trie = dict()
+        for literal in self._literals:
+            node = trie
+            for char in literal:
+                node = node.setdefault(re.escape(char), dict())
+            node[None] = ['']
+        scanner = re.compile(_trie_pattern(trie), re.DOTALL) if trie else None
+        self._scanner = (scanner, tuple((literal, frozenset(names)) for literal, names in self._literals.items()))
+        self._scanner_dirty = False
+
+    def _candidates(self, text):
+        """Names of filters with required literals that appear in text"""
+        scanner, literals = self._scanner
+        if not scanner:
+            return frozenset()
+        folded = fold_case(text)
+        if not scanner.search(folded):
+            return frozenset()
+        return {name for literal, names in literals if literal in folded for name in names}
+
+    def search(self, text, timeout=None, deadline=None):
+        """
+        Returns (name, regex, match) for the highest tier filter matching text, or None.
+
+        If evaluating all filters takes longer than timeout (in seconds), the filters that were running are re-run
+        on their own with the full timeout to find out which ones are too slow, and FilterTimeout is raised with them.
+        A deadline (time.monotonic()) shared with other searches can be passed instead of starting a new one.
+        """
+        if deadline is None and timeout is not None:
+            deadline = time.monotonic() + timeout
+        candidates = self._candidates(text)
+        self.searches += 1
+        if not candidates:
+            self.skipped += 1
+        try:
+            for tier in self._tiers.values():
+                if result := tier.search(text, candidates, deadline):
+                    return result
+        except _TierTimeout as e:
+            raise FilterTimeout([name for name, _regex in e.filters.items() if self._too_slow(_regex, text, timeout)])
+        return None
+
+    @staticmethod
+    def _too_slow(_regex, text, timeout):
+        try:
+            _regex.search(text, timeout=timeout, concurrent=True)
+        except TimeoutError:
+            return True
+        return False
+
+    def evaluate(self, text, timeout=None):
+        """
+        Runs every filter on its own on text, returns [(name, regex, match or None, seconds)].
+        The timeout caps slow filters, they count as not matching.
+        """
+        results = []
+        for tier in self._tiers.values():
+            for name, _filter in list(tier.filters.items()):
+                start = time.perf_counter()
+                try:
+                    m = _filter.regex.search(text, timeout=timeout, concurrent=True)
+                except TimeoutError:
+                    m = None
+                results.append((name, _filter.regex, m, time.perf_counter() - start))
+        return results
+
+    def profile(self, text, timeout=None):
+        """Returns {name: seconds} of running every filter on its own on text, the timeout caps slow ones"""
+        return {name: seconds for name, _, _, seconds in self.evaluate(text, timeout)}
+
+    def search_all(self, text, timeout=None):
+        """
+        Returns (name, regex, match) for every matching filter, evaluating each one separately,
+        and the names of filters that took longer than timeout (in seconds)
+        """
+        results = []
+        timed_out = []
+        for tier in self._tiers.values():
+            for name, _filter in list(tier.filters.items()):
+                try:
+                    if m := _filter.regex.search(text, timeout=timeout, concurrent=True):
+                        results.append((name, _filter.regex, m))
+                except TimeoutError:
+                    timed_out.append(name)
+        return results, timed_out
+
+
+class FilterScope:
+    """
+    Channels (or categories, or parent channels of threads) and roles a filter is restricted to.
+    A filter applies if the message is in one of the channels and its author has one of the roles, an empty set
+    means any channel/author.
+    """
+
+    __slots__ = ('channels', 'roles')
+
+    def __init__(self, channels=(), roles=()):
+        self.channels = frozenset(channels)
+        self.roles = frozenset(roles)
+
+    def __eq__(self, other):
+        return isinstance(other, FilterScope) and self.channels == other.channels and self.roles == other.roles
+
+    def __hash__(self):
+        return hash((self.channels, self.roles))
+
+    def matches_channel(self, channel_ids):
+        return not self.channels or not self.channels.isdisjoint(channel_ids)
+
+    def matches_roles(self, role_ids):
+        return not self.roles or not self.roles.isdisjoint(role_ids)
+
+
+GLOBAL_SCOPE = FilterScope()
+
+
+class ScopedFilterEngine:
+    """
+    One FilterEngine per distinct filter scope, so that a message is only evaluated against the filters that apply
+    to it. Which scopes apply to a channel is cached per channel, leaving only the role check for every message.
+
+    Same interface as FilterEngine, except that searches take the scopes returned by resolve().
+    Searches can be given a raw (e.g. not normalized) version of the text as well, filters added with raw=True
+    (e.g. ones that contain characters normalization would change) are then also evaluated against it.
+    """
+
+    def __init__(self):
+        self.engines = {GLOBAL_SCOPE: FilterEngine()}
+        # scope -> engine of the filters that are evaluated against the raw text as well
+        self.raw_engines = dict()
+        # name -> scope, name -> tier
+        self._scopes = dict()
+        self._tiers = dict()
+        # channel ids -> scopes whose channels match, cleared when scopes are added or removed
+        self._channels = dict()
+        self.searches = 0
+        self.skipped = 0
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._scopes)
+
+    @property
+    def unconditional(self):
+        return sum(engine.unconditional for engine in self.engines.values())
+
+    def set(self, name, regex: regex.Pattern, tier=TIER_DELETE, scope=GLOBAL_SCOPE, raw=False):
+        """Add or replace a filter"""
+        self.remove(name)
+        if (engine := self.engines.get(scope)) is None:
+            engine = self.engines[scope] = FilterEngine()
+            self._channels.clear()
+        engine.set(name, regex, tier)
+        if raw:
+            self.raw_engines.setdefault(scope, FilterEngine()).set(name, regex, tier)
+        self._scopes[name] = scope
+        self._tiers[name] = tier
+        self.generation += 1
+
+    def remove(self, name):
+        if (scope := self._scopes.pop(name, None)) is None:
+            return
+        del self._tiers[name]
+        engine = self.engines[scope]
+        engine.remove(name)
+        if not len(engine) and scope != GLOBAL_SCOPE:
+            del self.engines[scope]
+            self._channels.clear()
+        if (raw_engine := self.raw_engines.get(scope)) is not None:
+            raw_engine.remove(name)
+            if not len(raw_engine):
+                del self.raw_engines[scope]
+        self.generation += 1
+
+    def scope(self, name):
+        return self._scopes.get(name, GLOBAL_SCOPE)
+
+    def prepare(self):
+        for engine in (*self.engines.values(), *self.raw_engines.values()):
+            engine.prepare()
+
+    def resolve(self, channel_ids, role_ids=()):
+        """
+        Returns the scopes (a tuple, usable as a cache key) applying to a message in the channels channel_ids
+        (the channel itself, its parent and category) by an author with role_ids
+        """
+        if (scopes := self._channels.get(channel_ids)) is None:
+            scopes = tuple(scope for scope in self.engines if scope.matches_channel(channel_ids))
+            self._channels[channel_ids] = scopes
+        return tuple(scope for scope in scopes if scope.matches_roles(role_ids))
+
+    def _engines(self, scopes, text, raw=None):
+        """Returns [(engine, text to search)] for scopes (all if None), including the raw engines if raw differs"""
+        engines = [(self.engines, text)]
+        if raw is not None and raw != text:
+            engines.append((self.raw_engines, raw))
+        if scopes is None:
+            return [(engine, _text) for _engines, _text in engines for engine in list(_engines.values())]
+        # an engine may have been removed since the scopes were resolved
+        return [
+            (engine, _text)
+            for _engines, _text in engines
+            for scope in scopes
+            if (engine := _engines.get(scope)) is not None
+        ]
+
+    def search(self, text, timeout=None, scopes=None, raw=None):
+        """
+        Returns (name, regex, match) for the highest tier filter of scopes (all if None) matching text (or raw),
+        or None. The timeout covers all of them, see FilterEngine.search().
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        engines = self._engines(scopes, text, raw)
+        self.searches += 1
+        best = None
+        # the message counts as skipped by the prefilter if it was for every engine
+        skipped = True
+        for engine, _text in engines:
+            before = engine.skipped
+            result = engine.search(_text, timeout, deadline)
+            skipped = skipped and engine.skipped > before
+            if not result:
+                continue
+            if best is None or self._tiers.get(result[0], TIER_DELETE) > self._tiers.get(best[0], TIER_DELETE):
+                best = result
+            if self._tiers.get(best[0]) == TIER_BAN:
+                break
+        if skipped:
+            self.skipped += 1
+        return best
+
+    def evaluate(self, text, timeout=None, scopes=None, raw=None):
+        """
+        FilterEngine.evaluate() for the filters of scopes (all if None). Filters evaluated against both text and raw
+        are reported once, with the match in raw if there's none in text, and the time both searches took.
+        """
+        results = dict()
+        for engine, _text in self._engines(scopes, text, raw):
+            for name, _regex, m, seconds in engine.evaluate(_text, timeout):
+                if name in results:
+                    m = results[name][2] or m
+                    seconds += results[name][3]
+                results[name] = (name, _regex, m, seconds)
+        return list(results.values())
+
+    def profile(self, text, timeout=None, raw=None):
+        return {name: seconds for name, _, _, seconds in self.evaluate(text, timeout, raw=raw)}
+
+    def search_all(self, text, timeout=None, raw=None):
+        """FilterEngine.search_all() for all filters regardless of their scope, against text and raw"""
+        results = dict()
+        timed_out = []
+        for engine, _text in self._engines(None, text, raw):
+            _results, _timed_out = engine.search_all(_text, timeout)
+            for result in _results:
+                results.setdefault(result[0], result)
+            timed_out.extend(name for name in _timed_out if name not in timed_out)
+        return list(results.values()), timed_out
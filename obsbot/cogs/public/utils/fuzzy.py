@@ -0,0 +1,75 @@
+import heapq
+
+from collections import defaultdict
+
+
+def _trigrams(word):
+    padded = f'  {word} '
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Edit distance (with adjacent transpositions counting as one edit) between a and b.
+    Gives up, returning max_distance + 1, as soon as the limit is exceeded.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if before and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class TrigramIndex:
+    """Trigram index for "did you mean" lookups, supports incremental updates"""
+
+    def __init__(self, keys=()):
+        self._postings = defaultdict(set)
+        self._keys = dict()
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        if key in self._keys:
+            return
+        grams = self._keys[key] = _trigrams(key)
+        for gram in grams:
+            self._postings[gram].add(key)
+
+    def remove(self, key):
+        for gram in self._keys.pop(key, ()):
+            self._postings[gram].discard(key)
+            if not self._postings[gram]:
+                del self._postings[gram]
+
+    def search(self, query, limit=3, max_distance=2):
+        """Returns up to `limit` keys within `max_distance` edits of query, closest first"""
+        grams = _trigrams(query)
+        shared = defaultdict(int)
+        for gram in grams:
+            for key in self._postings.get(gram, ()):
+                shared[key] += 1
+        if not shared:
+            return []
+
+        # Rank by trigram similarity (Dice coefficient), then only verify the best few with the edit distance
+        candidates = heapq.nlargest(limit * 4, shared, key=lambda k: 2 * shared[k] / (len(grams) + len(self._keys[k])))
+        results = []
+        for key in candidates:
+            if (distance := edit_distance(query, key, max_distance)) <= max_distance:
+                results.append((distance, key))
+        return [key for _, key in sorted(results)[:limit]]
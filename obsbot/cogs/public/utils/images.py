@@ -0,0 +1,117 @@
+import io
+
+from collections import OrderedDict
+
+from PIL import Image
+
+# images with more pixels are not decoded at all (decompression bombs)
+_max_pixels = 40_000_000
+
+
+def dhash(data: bytes, size=8) -> int:
+    """
+    Difference hash of an image: it is scaled down to (size + 1) x size greyscale pixels and every bit of the
+    (size * size bit) hash says whether a pixel is brighter than its right neighbour. Re-encoding, scaling and small
+    colour changes only flip a few bits, so similar images have hashes with a small Hamming distance.
+    Raises ValueError (or PIL's exceptions) for anything that can't be decoded.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        if img.width * img.height > _max_pixels:
+            raise ValueError(f'Image too large: {img.width}x{img.height}')
+        # JPEGs can be decoded at a fraction of their size, which is most of the work
+        img.draft('L', (size * 4, size * 4))
+        if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+            # transparent pixels have arbitrary colours, put the image on white background like Discord does
+            img = Image.alpha_composite(Image.new('RGBA', img.size, 'white'), img.convert('RGBA'))
+        pixels = img.convert('L').resize((size + 1, size), Image.BILINEAR, reducing_gap=2.0).tobytes()
+
+    value = 0
+    for row in range(size):
+        for col in range(row * (size + 1), row * (size + 1) + size):
+            value = value << 1 | (pixels[col] > pixels[col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of hashes for lookups by Hamming distance. Children are keyed by their distance to the
+    parent, by the triangle inequality a lookup only has to descend into children whose key is within max_distance
+    of the parent's distance to the hash that is looked up. Removing requires rebuilding the tree.
+    """
+
+    def __init__(self, items=()):
+        # node: (hash, [values], {distance: child node})
+        self._root = None
+        self._size = 0
+        for key, value in items:
+            self.add(key, value)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, value):
+        self._size += 1
+        if self._root is None:
+            self._root = (key, [value], dict())
+            return
+        node = self._root
+        while True:
+            if (distance := hamming(key, node[0])) == 0:
+                node[1].append(value)
+                return
+            if (child := node[2].get(distance)) is None:
+                node[2][distance] = (key, [value], dict())
+                return
+            node = child
+
+    def search(self, key, max_distance):
+        """Returns [(distance, value)] of all hashes within max_distance of key, closest first"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_key, values, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                found.extend((distance, value) for value in values)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class HashCache:
+    """Bounded LRU of attachment URL -> image hash (None for attachments that aren't images)"""
+
+    def __init__(self, size=4096):
+        self.cache = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    @staticmethod
+    def key(url):
+        # attachment URLs carry signature parameters that differ between fetches of the same file
+        return url.split('?', 1)[0]
+
+    def lookup(self, key):
+        """Returns (True, hash) if key is cached, (False, None) otherwise"""
+        if key not in self.cache:
+            self.misses += 1
+            return False, None
+        self.cache.move_to_end(key)
+        self.hits += 1
+        return True, self.cache[key]
+
+    def store(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+
+from typing import Optional
+
+from disnake import Embed
+
+logger = logging.getLogger(__name__)
+
+# Discord's limit for bulk deletes
+_max_bulk_delete = 100
+# Discord's limits for embeds
+_max_fields = 25
+_max_field_length = 1024
+_max_embed_length = 6000
+_max_message_embeds = 10
+
+
+class ModerationQueue:
+    """
+    Runs moderation actions off the message path.
+
+    Deletes are batched per channel: the first one is sent right away, deletes that come in while a call for the
+    same channel is in flight are merged into one bulk delete. Bans and kicks run with bounded concurrency, and
+    are skipped for users whose ban/kick is still running (e.g. for several messages of the same spammer).
+    """
+
+    def __init__(self, concurrency=4):
+        # channel id -> [(message, future)] waiting to be deleted
+        self._deletes = dict()
+        # (action, user id) -> task
+        self._punishments = dict()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.deletes = 0
+        self.bulk_deletes = 0
+
+    @property
+    def pending(self):
+        return sum(map(len, self._deletes.values())) + len(self._punishments)
+
+    def delete(self, msg) -> asyncio.Future:
+        """Queue msg for deletion, the returned future resolves once it is deleted (or raises the error)"""
+        future = asyncio.get_running_loop().create_future()
+        if (pending := self._deletes.get(msg.channel.id)) is None:
+            pending = self._deletes[msg.channel.id] = []
+            asyncio.create_task(self._run_deletes(msg.channel, pending))
+        pending.append((msg, future))
+        return future
+
+    async def _run_deletes(self, channel, pending):
+        try:
+            while pending:
+                batch = pending[:_max_bulk_delete]
+                del pending[:_max_bulk_delete]
+                await self._delete_batch(channel, batch)
+        finally:
+            del self._deletes[channel.id]
+
+    async def _delete_batch(self, channel, batch):
+        if len(batch) > 1 and hasattr(channel, 'delete_messages'):
+            try:
+                await channel.delete_messages([msg for msg, _ in batch])
+            except Exception as e:
+                # e.g. messages older than 14 days can't be bulk deleted, try them one by one
+                logger.warning(f'Bulk deleting {len(batch)} messages in {channel} failed: {e!r}')
+            else:
+                self.deletes += len(batch)
+                self.bulk_deletes += 1
+                for _, future in batch:
+                    future.set_result(None)
+                return
+
+        for msg, future in batch:
+            try:
+                await msg.delete()
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                self.deletes += 1
+                future.set_result(None)
+
+    def ban(self, member, **kwargs) -> Optional[asyncio.Task]:
+        """Returns the task banning member, None if it is already being banned"""
+        return self._punish('ban', member, member.ban, kwargs)
+
+    def kick(self, member, **kwargs) -> Optional[asyncio.Task]:
+        """Returns the task kicking member, None if it is already being kicked"""
+        return self._punish('kick', member, member.kick, kwargs)
+
+    def _punish(self, action, member, func, kwargs):
+        key = (action, member.id)
+        if key in self._punishments:
+            return None
+        self._punishments[key] = task = asyncio.create_task(self._limited(func(**kwargs)))
+        task.add_done_callback(lambda _: self._punishments.pop(key, None))
+        return task
+
+    async def _limited(self, coro):
+        async with self._semaphore:
+            return await coro
+
+
+class LogBatcher:
+    """
+    Sends embeds to the moderation log channel, batched during bursts.
+
+    After a quiet period an embed is sent right away, embeds posted within `window` seconds of the last send are
+    held back and sent together, up to 10 per message. Embeds with the same key (e.g. filter and user) are merged
+    into one, which lists the note of every merged entry.
+    """
+
+    def __init__(self, window=2.0):
+        self.channel = None
+        self.window = window
+        # [(key, embed, note)] waiting to be sent
+        self._pending = []
+        self._task = None
+        self._last_send = None
+        self.sent = 0
+        self.merged = 0
+
+    def post(self, embed, key=None, note=None):
+        self._pending.append((key, embed, note))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                if self._last_send is not None and (delay := self._last_send + self.window - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+                batch, self._pending = self._pending, []
+                if self.channel is None:
+                    logger.warning(f'No moderation log channel, dropping {len(batch)} embeds')
+                    continue
+                for embeds in chunk_embeds(self._merge(batch)):
+                    try:
+                        await self.channel.send(embeds=embeds)
+                        self.sent += 1
+                    except Exception as e:
+                        logger.error(f'Sending {len(embeds)} moderation log embeds failed: {e!r}')
+                self._last_send = loop.time()
+        finally:
+            self._task = None
+
+    def _merge(self, batch):
+        """Replace embeds with the same key by the first one of them, listing all of their notes"""
+        order = []
+        notes = dict()
+        for key, embed, note in batch:
+            if key is not None and key in notes:
+                notes[key].append(note)
+                self.merged += 1
+                continue
+            order.append((key, embed))
+            if key is not None:
+                notes[key] = [note]
+
+        embeds = []
+        for key, embed in order:
+            if key is not None and len(notes[key]) > 1:
+                embed = embed.copy()
+                embed.add_field(
+                    name=f'All {len(notes[key])} matches', value=_truncate_lines(notes[key], 1024), inline=False
+                )
+            embeds.append(embed)
+        return embeds
+
+
+def chunk_embeds(embeds):
+    """Split embeds into messages of at most 10 embeds and 6000 characters (Discord's limits)"""
+    chunk, size = [], 0
+    for embed in embeds:
+        if chunk and (len(chunk) == _max_message_embeds or size + len(embed) > _max_embed_length):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(embed)
+        size += len(embed)
+    if chunk:
+        yield chunk
+
+
+def split_lines(lines, template='{}', limit=_max_field_length):
+    """
+    Join lines into as few field values as possible that are at most `limit` characters long once formatted with
+    `template` (e.g. a code block), lines that don't fit into a value on their own are cut
+    """
+    room = limit - len(template.format(''))
+    values, current = [], None
+    for line in lines:
+        line = line[:room]
+        if current is not None and len(current) + 1 + len(line) > room:
+            values.append(template.format(current))
+            current = None
+        current = line if current is None else f'{current}\n{line}'
+    if current is not None:
+        values.append(template.format(current))
+    return values
+
+
+def paginate_fields(title, fields, description=None, footer=None):
+    """
+    Embeds with the (name, value) fields, a new embed titled "<title> (continued)" is started whenever the next
+    field would exceed Discord's limits of 25 fields or 6000 characters per embed. The footer goes on the last one.
+    """
+    reserved = len(footer) if footer else 0
+    embeds = [Embed(title=title, description=description)]
+    for name, value in fields:
+        embed = embeds[-1]
+        if len(embed.fields) == _max_fields or len(embed) + len(name) + len(value) + reserved > _max_embed_length:
+            embed = Embed(title=f'{title} (continued)')
+            embeds.append(embed)
+        embed.add_field(name=name, value=value, inline=False)
+    if footer:
+        embeds[-1].set_footer(text=footer)
+    return embeds
+
+
+def _truncate_lines(lines, limit):
+    text = ''
+    for idx, line in enumerate(lines):
+        more = f'\n... and {len(lines) - idx} more'
+        if len(text) + len(line) + 1 + len(more) > limit:
+            return text + more
+        text += f'\n{line}' if text else line
+    return text
@@ -0,0 +1,104 @@
+import re
+import unicodedata
+
+from functools import lru_cache
+
+# letters from other scripts that look like Latin ones, NFKC already handles fullwidth, mathematical, circled etc. forms
+# fmt: off
+_confusables = {
+    # Cyrillic
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p', 'с': 'c',
+    'т': 't', 'у': 'y', 'х': 'x', 'ѕ': 's', 'і': 'i', 'ї': 'i', 'ј': 'j', 'һ': 'h', 'ԁ': 'd', 'ԛ': 'q', 'ԝ': 'w',
+    'ӏ': 'l', 'ь': 'b', 'п': 'n', 'г': 'r', 'А': 'A', 'В': 'B', 'Е': 'E', 'К': 'K', 'М': 'M', 'Н': 'H',
+    'О': 'O', 'Р': 'P', 'С': 'C', 'Т': 'T', 'У': 'Y', 'Х': 'X', 'Ѕ': 'S', 'І': 'I', 'Ј': 'J', 'Ԁ': 'D', 'Ԛ': 'Q',
+    'Ԝ': 'W', 'Ӏ': 'l',
+    # Greek
+    'α': 'a', 'β': 'b', 'ε': 'e', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o', 'ρ': 'p', 'τ': 't', 'υ': 'u', 'χ': 'x',
+    'ω': 'w', 'Α': 'A', 'Β': 'B', 'Ε': 'E', 'Ζ': 'Z', 'Η': 'H', 'Ι': 'I', 'Κ': 'K', 'Μ': 'M', 'Ν': 'N', 'Ο': 'O',
+    'Ρ': 'P', 'Τ': 'T', 'Υ': 'Y', 'Χ': 'X',
+    # Armenian, Cherokee and Latin look-alikes
+    'օ': 'o', 'ս': 'u', 'ց': 'g', 'հ': 'h', 'ո': 'n', 'Ꭺ': 'A', 'Ᏼ': 'B', 'Ꮯ': 'C', 'Ꭼ': 'E', 'Ꮋ': 'H', 'Ꮶ': 'K',
+    'Ꮇ': 'M', 'Ꮲ': 'P', 'Ꭲ': 'T', 'ı': 'i', 'ȷ': 'j', 'ɡ': 'g', 'ɑ': 'a', 'ʟ': 'L', 'ɪ': 'I', 'ɴ': 'N', 'ʀ': 'R',
+    'ʏ': 'Y', 'ʙ': 'B', 'ɢ': 'G', 'ʜ': 'H',
+    # small capitals
+    'ᴀ': 'A', 'ᴄ': 'C', 'ᴅ': 'D', 'ᴇ': 'E', 'ꜰ': 'F', 'ᴊ': 'J', 'ᴋ': 'K', 'ᴍ': 'M', 'ᴏ': 'O', 'ᴘ': 'P', 'ꜱ': 'S',
+    'ᴛ': 'T', 'ᴜ': 'U', 'ᴠ': 'V', 'ᴡ': 'W', 'ᴢ': 'Z',
+    # ideographic full stop, e.g. in domains
+    '。': '.',
+}
+# fmt: on
+# regional indicator symbols (flag emoji halves) spell out words as well
+_confusables.update((chr(0x1F1E6 + i), chr(ord('a') + i)) for i in range(26))
+
+# characters without a visible glyph that aren't format characters (Cf), which are stripped anyway
+_invisible = {0x115F, 0x1160, 0x2800, 0x3164, 0xFFA0}
+
+# regex escapes that can refer to non-ASCII characters: \uXXXX, \UXXXXXXXX, \N{name}, \x80-\xff and \p{property}
+_non_ascii_escape_re = re.compile(r'(?<!\\)(?:\\\\)*\\(?:[uUpP]|N\{|x[89a-fA-F])')
+# negated character classes like [^\x00-\x7F] or [^a-z] match the characters that normalization replaces or strips
+_negated_class_re = re.compile(r'(?<!\\)(?:\\\\)*\[\^')
+
+
+class _NormalizationTable(dict):
+    """
+    str.translate() table of code point -> replacement (None to strip it): NFKC, then the confusables map.
+    Invisible and combining characters (e.g. zero-width spaces and joiners, or stacked "zalgo" marks) are stripped.
+    Confusables and invisible characters are precomputed, other characters are added the first time they are seen.
+    """
+
+    def __init__(self):
+        super().__init__()
+        for char in _confusables:
+            self[ord(char)] = self._compute(ord(char))
+        for code in _invisible:
+            self[code] = None
+
+    @staticmethod
+    def _compute(code):
+        char = chr(code)
+        if code in _invisible or unicodedata.category(char) in ('Cf', 'Mn', 'Me'):
+            return None
+        normalized = ''.join(
+            _confusables.get(c, c)
+            for c in unicodedata.normalize('NFKC', char)
+            if unicodedata.category(c) not in ('Cf', 'Mn', 'Me')
+        )
+        # translate() is faster for characters that are kept if they aren't in the table, but they'd be computed again
+        return code if normalized == char else normalized
+
+    def __missing__(self, code):
+        value = self[code] = self._compute(code)
+        return value
+
+
+_table = _NormalizationTable()
+
+
+def normalize(text):
+    """
+    Normalized text for filtering: homoglyphs, fullwidth and other compatibility forms are replaced by the
+    (Latin) characters they look like, invisible characters and combining marks are removed.
+    Only for matching, the result isn't meant to be displayed.
+    """
+    # most messages are plain ASCII, which is left as is
+    if text.isascii():
+        return text
+    return text.translate(_table)
+
+
+@lru_cache(maxsize=1024)
+def normalize_message(text):
+    """normalize() with a cache for the content of recent messages, so that every listener can use it for free"""
+    return normalize(text)
+
+
+def normalization_sensitive(pattern):
+    """
+    True if a regex pattern contains characters (literally, as escapes or by negated classes) that normalization may
+    change or strip, such a pattern may not match normalized text, e.g. "бесплатно", "\\u200b" or "[^\\x00-\\x7F]"
+    """
+    return (
+        normalize(pattern) != pattern
+        or _non_ascii_escape_re.search(pattern) is not None
+        or _negated_class_re.search(pattern) is not None
+    )
@@ -0,0 +1,210 @@
+import time
+
+from collections import Counter, OrderedDict, deque
+
+from .filters import fold_case
+
+_mask = (1 << 64) - 1
+
+
+class MinHasher:
+    """
+    MinHash signatures of character shingles, similar texts get signatures with many equal positions.
+    Uses one-permutation hashing (every shingle is hashed once and only updates the minimum of one bin) instead of
+    one hash function per position, empty bins are filled from the next non-empty one ("densification").
+    Python's string hash is randomised per process, so signatures must not be persisted.
+    """
+
+    def __init__(self, size=32, shingle=4, min_length=16, max_length=512):
+        self.size = size
+        self.shingle = shingle
+        # shorter messages ("hi", "thanks!") are too common to be compared, longer ones are truncated
+        self.min_length = min_length
+        self.max_length = max_length
+
+    def signature(self, text):
+        """Returns the signature of text (a tuple of ints), None if it's too short"""
+        text = ' '.join(fold_case(text[: self.max_length]).split())
+        if len(text) < self.min_length:
+            return None
+        size, k = self.size, self.shingle
+        bins = [None] * size
+        for i in range(len(text) - k + 1):
+            value, idx = divmod(hash(text[i : i + k]) & _mask, size)
+            if bins[idx] is None or value < bins[idx]:
+                bins[idx] = value
+        # an empty bin takes the value of the next non-empty one, offset by the distance so that it differs from it
+        filled = [i for i, value in enumerate(bins) if value is not None]
+        for i, value in enumerate(bins):
+            if value is None:
+                j = next((j for j in filled if j > i), filled[0])
+                bins[i] = bins[j] + ((j - i) % size << 64)
+        return tuple(bins)
+
+
+def similarity(sig, other):
+    """Estimated Jaccard similarity of the shingles behind two signatures"""
+    return sum(x == y for x, y in zip(sig, other)) / len(sig)
+
+
+class LSHIndex:
+    """
+    Locality-sensitive hashing of MinHash signatures: a signature is split into bands, signatures that share any band
+    are candidates for being similar. Buckets only keep their newest `bucket_size` entries, so a lookup costs at most
+    bands * bucket_size comparisons even if thousands of copies of a message are indexed.
+    """
+
+    def __init__(self, bands=16, bucket_size=32):
+        self.bands = bands
+        self.bucket_size = bucket_size
+        # (band, band values) -> {entry id: None}, dicts keep insertion order so the oldest entry is first
+        self._buckets = dict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _keys(self, sig):
+        rows = len(sig) // self.bands
+        return [(band, sig[band * rows : (band + 1) * rows]) for band in range(self.bands)]
+
+    def add(self, entry_id, sig):
+        for key in self._keys(sig):
+            bucket = self._buckets.setdefault(key, dict())
+            bucket[entry_id] = None
+            if len(bucket) > self.bucket_size:
+                del bucket[next(iter(bucket))]
+
+    def remove(self, entry_id, sig):
+        for key in self._keys(sig):
+            if (bucket := self._buckets.get(key)) is None:
+                continue
+            bucket.pop(entry_id, None)
+            if not bucket:
+                del self._buckets[key]
+
+    def candidates(self, sig):
+        """Returns a Counter of entry id -> number of bands it shares with sig"""
+        found = Counter()
+        for key in self._keys(sig):
+            if bucket := self._buckets.get(key):
+                # keys only, Counter.update() would take a dict's values as counts
+                found.update(bucket.keys())
+        return found
+
+
+class RaidDetector:
+    """
+    Flags message floods and spam waves: per-user and per-guild message rates within a sliding window, and
+    near-duplicate messages posted by several accounts or by one account in several channels (via MinHash + LSH).
+    Only messages within the window (and at most max_messages of them) are kept.
+    """
+
+    def __init__(
+        self,
+        window=30.0,
+        user_rate=10,
+        guild_rate=300,
+        duplicate_users=3,
+        duplicate_channels=3,
+        threshold=0.5,
+        max_messages=5000,
+    ):
+        self.window = window
+        self.user_rate = user_rate
+        self.guild_rate = guild_rate
+        self.duplicate_users = duplicate_users
+        self.duplicate_channels = duplicate_channels
+        self.threshold = threshold
+        self.max_messages = max_messages
+
+        self.hasher = MinHasher()
+        self.index = LSHIndex()
+        # user id -> deque of message timestamps, ordered by last message so inactive users are dropped from the front
+        self._users = OrderedDict()
+        # guild id -> deque of message timestamps
+        self._guilds = dict()
+        # (timestamp, entry id) of indexed messages, oldest first
+        self._messages = deque()
+        # entry id -> (user id, channel id, signature)
+        self._entries = dict()
+        self._next_id = 0
+        self.checked = 0
+        self.flagged = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self._users:
+            user_id, stamps = next(iter(self._users.items()))
+            if stamps[-1] > cutoff:
+                break
+            del self._users[user_id]
+        for guild_id, stamps in list(self._guilds.items()):
+            while stamps and stamps[0] <= cutoff:
+                stamps.popleft()
+            if not stamps:
+                del self._guilds[guild_id]
+        while self._messages and (self._messages[0][0] <= cutoff or len(self._messages) > self.max_messages):
+            _, entry_id = self._messages.popleft()
+            self.index.remove(entry_id, self._entries.pop(entry_id)[2])
+
+    @staticmethod
+    def _count(stamps, now, cutoff):
+        while stamps and stamps[0] <= cutoff:
+            stamps.popleft()
+        stamps.append(now)
+        return len(stamps)
+
+    def check(self, guild_id, channel_id, user_id, text, now=None):
+        """
+        Record a message, returns (kind, description, ids of the users involved) if it is part of a flood or spam wave,
+        otherwise None
+        """
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.window
+        self._expire(now)
+        self.checked += 1
+
+        user_stamps = self._users.setdefault(user_id, deque())
+        self._users.move_to_end(user_id)
+        user_count = self._count(user_stamps, now, cutoff)
+        guild_count = self._count(self._guilds.setdefault(guild_id, deque()), now, cutoff)
+
+        result = None
+        if (sig := self.hasher.signature(text)) is not None:
+            result = self._check_duplicates(channel_id, user_id, sig)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (user_id, channel_id, sig)
+            self._messages.append((now, entry_id))
+            self.index.add(entry_id, sig)
+
+        if not result and user_count > self.user_rate:
+            result = ('user_rate', f'{user_count} messages within {self.window:.0f} seconds', {user_id})
+        if not result and guild_count > self.guild_rate:
+            result = ('guild_rate', f'{guild_count} messages server-wide within {self.window:.0f} seconds', set())
+        if result:
+            self.flagged += 1
+        return result
+
+    def _check_duplicates(self, channel_id, user_id, sig):
+        users = {user_id}
+        channels = {channel_id}
+        # most similar first, stop once there is enough evidence
+        for entry_id, _ in self.index.candidates(sig).most_common():
+            other_user, other_channel, other_sig = self._entries[entry_id]
+            if similarity(sig, other_sig) < self.threshold:
+                continue
+            users.add(other_user)
+            if other_user == user_id:
+                channels.add(other_channel)
+            if len(users) >= self.duplicate_users or len(channels) >= self.duplicate_channels:
+                break
+
+        if len(users) >= self.duplicate_users:
+            return 'duplicate_users', f'near-duplicate message posted by {len(users)} accounts', users
+        if len(channels) >= self.duplicate_channels:
+            return 'duplicate_channels', f'near-duplicate message posted in {len(channels)} channels', users
+        return None
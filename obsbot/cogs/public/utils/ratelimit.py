@@ -1,26 +1,65 @@
 import time
 
+from collections import OrderedDict
+
 
 class RateLimiter:
-    """Custom rate limiter for factoids/log analysis"""
+    """
+    Custom rate limiter for factoids/log analysis
+
+    Every key gets a token bucket holding up to `burst` tokens, one token is refilled every `cooldown` seconds.
+    With the default burst of 1 a key is limited for `cooldown` seconds after it was last allowed.
+    """
 
-    def __init__(self, cooldown=5.0):
-        self.cache = dict()
+    def __init__(self, cooldown=5.0, burst=1):
+        # key -> (tokens, last update), ordered by last update so expired buckets can be dropped from the front
+        self.cache = OrderedDict()
         self.cooldown = cooldown
+        self.burst = burst
+        # a bucket that has not been touched for this long is full again and does not need to be kept
+        self._ttl = cooldown * burst
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.cache)
 
     def _cleanup(self, now):
-        """Remove keys that are expired (older than t + cooldown)"""
-        expired_keys = [k for k, t in self.cache.items() if (now - t) >= self.cooldown]
-        for key in expired_keys:
+        """Remove buckets that have been refilled completely, only looks at as many entries as it removes (+1)"""
+        while self.cache:
+            key, (_, updated) = next(iter(self.cache.items()))
+            if now - updated < self._ttl:
+                break
             del self.cache[key]
+            self.evictions += 1
+
+    def _tokens(self, key, now):
+        if (bucket := self.cache.get(key)) is None:
+            return self.burst
+        tokens, updated = bucket
+        return min(self.burst, tokens + (now - updated) / self.cooldown)
+
+    def _take(self, key, tokens, now):
+        self.cache[key] = (tokens - 1, now)
+        self.cache.move_to_end(key)
 
     def is_limited(self, *key):
-        now = time.time()
-        # remove expired keys
-        self._cleanup(now)
+        return check_limits((self, key))
+
 
-        if key not in self.cache:
-            self.cache[key] = now
-            return False
+def check_limits(*checks):
+    """
+    Check (limiter, key) pairs at once, e.g. for per user, per channel and global quotas.
+    Tokens are only taken if none of them is limited, returns True if any of them is.
+    """
+    now = time.monotonic()
+    tokens = []
+    for limiter, key in checks:
+        limiter._cleanup(now)
+        tokens.append(limiter._tokens(key, now))
 
+    if any(t < 1 for t in tokens):
         return True
+
+    for (limiter, key), t in zip(checks, tokens):
+        limiter._take(key, t, now)
+    return False
@@ -0,0 +1,52 @@
+class LatencyHistogram:
+    """Fixed-size latency histogram with power-of-two bucket boundaries in microseconds"""
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self, size=24):
+        # bucket n counts samples in [2^(n-1), 2^n) µs, the last one everything above
+        self.buckets = [0] * size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def restore(cls, buckets, total: float, maximum: float, size=24):
+        """Recreate a histogram from persisted buckets, total and max (e.g. loaded from the DB)"""
+        hist = cls(size)
+        for idx, count in enumerate(buckets or ()):
+            hist.buckets[min(idx, size - 1)] += count
+        hist.count = sum(hist.buckets)
+        hist.total = total or 0.0
+        hist.max = maximum or 0.0
+        return hist
+
+    def record(self, seconds: float):
+        idx = min(int(seconds * 1_000_000).bit_length(), len(self.buckets) - 1)
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        """Returns upper bound (in seconds) of the bucket containing the p-th percentile (0 < p <= 1)"""
+        if not self.count:
+            return 0.0
+        threshold = p * self.count
+        cumulative = 0
+        for idx, bucket in enumerate(self.buckets):
+            cumulative += bucket
+            if cumulative >= threshold:
+                return min((1 << idx) / 1_000_000, self.max)
+        return self.max
+
+    def summary(self) -> str:
+        return (
+            f'p50: {self.percentile(0.5) * 1000:.1f} ms, p95: {self.percentile(0.95) * 1000:.1f} ms, '
+            f'max: {self.max * 1000:.1f} ms ({self.count} samples)'
+        )
@@ -0,0 +1,180 @@
+import logging
+import re
+
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_LITERAL = 0
+_VARIABLE = 1
+_REFERENCE = 2
+
+
+class FactoidTemplate:
+    """Factoid message pre-split into literal, variable and factoid reference segments"""
+
+    __slots__ = ('segments', 'variables', 'references')
+
+    def __init__(self, segments):
+        self.segments = tuple(segments)
+        self.variables = frozenset(v for k, v in self.segments if k == _VARIABLE)
+        self.references = frozenset(v for k, v in self.segments if k == _REFERENCE)
+
+    @property
+    def dependencies(self):
+        return {('var', v) for v in self.variables} | {('ref', r) for r in self.references}
+
+
+class TemplateCache:
+    """
+    Compiles factoid messages once and caches their rendered output.
+
+    Rendered messages are only invalidated when one of their dependencies changes, that is either a state
+    variable (e.g. the nightly build URLs) or a factoid referenced via `%factoid:name%`.
+    """
+
+    def __init__(self, state, variables, lookup, default='https://obsproject.com/4oh4'):
+        self.state = state
+        # placeholder (e.g. "%nightly_url%") -> state variable, shared with (and modified by) the owner
+        self.variables = variables
+        # resolves factoid names/aliases to the canonical factoid name (or None)
+        self.lookup = lookup
+        self.default = default
+
+        self._pattern = None
+        self._templates = dict()
+        self._messages = dict()
+        self._names = dict()
+        self._rendered = dict()
+        # dependency ("var"/"ref", name) -> names of factoids using it
+        self._dependents = defaultdict(set)
+        self._build_pattern()
+
+    def _build_pattern(self):
+        alternatives = [re.escape(v) for v in sorted(self.variables, key=len, reverse=True)]
+        alternatives.append(r'%factoid:(?P<ref>[^\s%]+)%')
+        self._pattern = re.compile('|'.join(alternatives))
+
+    def compile(self, message) -> FactoidTemplate:
+        if '%' not in message:
+            return FactoidTemplate([(_LITERAL, message)])
+
+        segments = []
+        pos = 0
+        for m in self._pattern.finditer(message):
+            if m.start() > pos:
+                segments.append((_LITERAL, message[pos : m.start()]))
+            if ref := m.group('ref'):
+                segments.append((_REFERENCE, ref.lower()))
+            else:
+                segments.append((_VARIABLE, self.variables[m.group()]))
+            pos = m.end()
+        if pos < len(message):
+            segments.append((_LITERAL, message[pos:]))
+        return FactoidTemplate(segments)
+
+    def check(self, name, message, names):
+        """Raises ValueError if factoid `name` (known as `names`) with `message` would reference itself"""
+        own_names = set(names)
+        template = self.compile(message)
+        stack = [(ref, (name,)) for ref in template.references]
+        seen = set()
+
+        while stack:
+            ref, path = stack.pop()
+            if ref in own_names:
+                raise ValueError('Circular factoid reference: {}'.format(' -> '.join(path + (name,))))
+            target = self.lookup(ref)
+            if not target or target == name or target in seen or target not in self._templates:
+                continue
+            seen.add(target)
+            stack.extend((r, path + (target,)) for r in self._templates[target].references)
+
+    def set(self, name, message, names):
+        """Add or update a factoid's template, `names` are all names (including aliases) it can be referenced by"""
+        old_names = self._names.get(name, ())
+        self._unregister(name)
+
+        template = self.compile(message)
+        self._templates[name] = template
+        self._messages[name] = message
+        self._names[name] = tuple(names)
+        for dependency in template.dependencies:
+            self._dependents[dependency].add(name)
+
+        for ref_name in set(old_names) | set(names):
+            self.invalidate(('ref', ref_name))
+
+    def remove(self, name):
+        names = self._names.get(name, ())
+        self._unregister(name)
+        self._templates.pop(name, None)
+        self._messages.pop(name, None)
+        self._names.pop(name, None)
+
+        for ref_name in names:
+            self.invalidate(('ref', ref_name))
+
+    def load(self, entries):
+        """Replace all templates, `entries` maps factoid names to (message, names) tuples"""
+        self._templates = dict()
+        self._messages = dict()
+        self._names = dict()
+        self._rendered = dict()
+        self._dependents = defaultdict(set)
+
+        for name, (message, names) in entries.items():
+            self.set(name, message, names)
+
+        for name, (message, names) in entries.items():
+            try:
+                self.check(name, message, names)
+            except ValueError as e:
+                logger.warning(f'Factoid "{name}" is invalid: {e}')
+
+    def recompile(self):
+        """Recompile all templates, required after the set of variables has changed"""
+        self._build_pattern()
+        self.load({name: (message, self._names[name]) for name, message in self._messages.items()})
+
+    def _unregister(self, name):
+        if template := self._templates.get(name):
+            for dependency in template.dependencies:
+                self._dependents[dependency].discard(name)
+                if not self._dependents[dependency]:
+                    del self._dependents[dependency]
+        self._rendered.pop(name, None)
+
+    def invalidate(self, dependency):
+        """Drop cached output of all factoids (transitively) depending on `dependency`"""
+        for name in list(self._dependents.get(dependency, ())):
+            # if something is not cached, neither is anything that depends on it
+            if self._rendered.pop(name, None) is None:
+                continue
+            for ref_name in self._names[name]:
+                self.invalidate(('ref', ref_name))
+
+    def on_state_change(self, key, _value):
+        self.invalidate(('var', key))
+
+    def render(self, name, _stack=()) -> str:
+        if (rendered := self._rendered.get(name)) is not None:
+            return rendered
+
+        parts = []
+        for kind, value in self._templates[name].segments:
+            if kind == _LITERAL:
+                parts.append(value)
+            elif kind == _VARIABLE:
+                parts.append(self.state.get(value, self.default))
+            else:
+                target = self.lookup(value)
+                # references that do not resolve (or would loop) are left as-is
+                if not target or target == name or target in _stack or target not in self._templates:
+                    parts.append(f'%factoid:{value}%')
+                else:
+                    parts.append(self.render(target, _stack + (name,)))
+
+        rendered = ''.join(parts)
+        self._rendered[name] = rendered
+        return rendered
@@ -0,0 +1,133 @@
+import heapq
+import math
+import re
+
+from collections import Counter, defaultdict
+
+_token_re = re.compile(r'\w+')
+_stopwords = frozenset('''
+    a about an and are as at be but by can com do does for from have how http https i if in is it its me my
+    no not of on or so that the this to was what when where which who why will with www you your
+    '''.split())
+
+
+def tokenize(text):
+    return [t for t in _token_re.findall(text.lower()) if len(t) > 1 and t not in _stopwords]
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index with BM25 ranking (for searches) and TF-IDF cosine similarity (for matching text
+    against documents), documents can be added/replaced/removed individually.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        # term -> {document: term frequency}
+        self._postings = defaultdict(dict)
+        self._documents = dict()
+        self._total_length = 0
+        # unit length TF-IDF vectors for similarity, stored as term -> {document: weight}. The IDFs are snapshotted
+        # so that an edit only has to update its own document, the snapshot is renewed once enough documents changed.
+        self._vectors = defaultdict(dict)
+        self._idfs = dict()
+        self._changes = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, doc, text):
+        """Add document (or replace it, if it already exists)"""
+        self.remove(doc)
+        terms = Counter(tokenize(text))
+        self._documents[doc] = (terms, sum(terms.values()))
+        self._total_length += self._documents[doc][1]
+        for term, freq in terms.items():
+            self._postings[term][doc] = freq
+        self._add_vector(doc, terms)
+
+    def remove(self, doc):
+        if doc not in self._documents:
+            return
+        terms, length = self._documents.pop(doc)
+        self._total_length -= length
+        for term in terms:
+            del self._postings[term][doc]
+            if not self._postings[term]:
+                del self._postings[term]
+            del self._vectors[term][doc]
+            if not self._vectors[term]:
+                del self._vectors[term]
+
+    def idf(self, term):
+        df = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self._documents) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, limit=5):
+        """Returns list of up to `limit` (document, score) tuples, best match first"""
+        if not self._documents:
+            return []
+        avg_length = self._total_length / len(self._documents) or 1
+        scores = defaultdict(float)
+
+        for term in set(tokenize(query)):
+            if not (postings := self._postings.get(term)):
+                continue
+            idf = self.idf(term)
+            for doc, freq in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._documents[doc][1] / avg_length)
+                scores[doc] += idf * freq * (self.k1 + 1) / (freq + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda a: a[1])
+
+    @staticmethod
+    def _tf(freq):
+        return 1 + math.log(freq)
+
+    def _snapshot_idf(self, term):
+        if (idf := self._idfs.get(term)) is None:
+            idf = self._idfs[term] = self.idf(term)
+        return idf
+
+    def _add_vector(self, doc, terms):
+        self._changes += 1
+        weights = {term: self._tf(freq) * self._snapshot_idf(term) for term, freq in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        for term, weight in weights.items():
+            self._vectors[term][doc] = weight / norm
+
+    def refresh_vectors(self):
+        """Renew IDF snapshot and all document vectors, e.g. after a bulk load"""
+        self._idfs = {term: self.idf(term) for term in self._postings}
+        self._vectors.clear()
+        for doc, (terms, _) in self._documents.items():
+            self._add_vector(doc, terms)
+        self._changes = 0
+
+    def refresh_stale_vectors(self):
+        """Renew the IDF snapshot once enough documents changed since the last one, meant to be called after edits"""
+        if self._changes > max(16, len(self._documents) // 10):
+            self.refresh_vectors()
+
+    def similar(self, text, limit=1):
+        """
+        Returns list of up to `limit` (document, cosine similarity) tuples comparing TF-IDF vectors, best first.
+        Never renews the IDF snapshot itself, so that it is cheap to call for every message.
+        """
+        query = {
+            term: self._tf(freq) * self._idfs.get(term, self.idf(term))
+            for term, freq in Counter(tokenize(text)).items()
+        }
+        if not query:
+            return []
+        # terms unknown to the index still count towards the query's norm, so off-topic text scores lower
+        query_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+        scores = defaultdict(float)
+
+        for term, weight in query.items():
+            for doc, doc_weight in self._vectors.get(term, {}).items():
+                scores[doc] += weight * doc_weight
+
+        return [(doc, score / query_norm) for doc, score in heapq.nlargest(limit, scores.items(), key=lambda a: a[1])]
@@ -0,0 +1,124 @@
+class PrefixTrie:
+    """Character trie for prefix lookups (e.g. autocomplete), supports incremental updates"""
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self, keys=()):
+        # nodes are dicts of character -> child node, the None key holds the full key if a node terminates one
+        self._root = dict()
+        self._size = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key):
+        node = self._root
+        for char in key:
+            node = node.setdefault(char, dict())
+        if None not in node:
+            node[None] = key
+            self._size += 1
+
+    def remove(self, key):
+        path = []
+        node = self._root
+        for char in key:
+            if char not in node:
+                return
+            path.append((node, char))
+            node = node[char]
+        if node.pop(None, None) is None:
+            return
+        self._size -= 1
+        # prune branches that no longer lead anywhere
+        for parent, char in reversed(path):
+            if parent[char]:
+                break
+            del parent[char]
+
+    def iter_prefix(self, prefix):
+        """Yields all keys starting with prefix"""
+        node = self._root
+        for char in prefix:
+            if char not in node:
+                return
+            node = node[char]
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    yield child
+                else:
+                    stack.append(child)
+
+
+class DomainTrie:
+    """
+    Trie of domain names by their labels in reverse order ("com" -> "example" -> "www"), so that finding the
+    entry covering a host (the host itself or one of its parent domains) takes one step per label of the host.
+    Every entry has a value, e.g. what to do when it matches.
+    """
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self, items=()):
+        # nodes are dicts of label -> child node, the None key holds (domain, value) if a node terminates an entry
+        self._root = dict()
+        self._size = 0
+        for domain, value in items:
+            self.add(domain, value)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, domain, value=None):
+        node = self._root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, dict())
+        if None not in node:
+            self._size += 1
+        node[None] = (domain, value)
+
+    def remove(self, domain):
+        """Returns whether domain was in the trie"""
+        path = []
+        node = self._root
+        for label in reversed(domain.split('.')):
+            if label not in node:
+                return False
+            path.append((node, label))
+            node = node[label]
+        if node.pop(None, None) is None:
+            return False
+        self._size -= 1
+        # prune branches that no longer lead anywhere
+        for parent, label in reversed(path):
+            if parent[label]:
+                break
+            del parent[label]
+        return True
+
+    def match(self, host):
+        """Returns (domain, value) of the entry host is or is a subdomain of, None if there is none"""
+        node = self._root
+        for label in reversed(host.split('.')):
+            if (node := node.get(label)) is None:
+                return None
+            if None in node:
+                return node[None]
+        return None
+
+    def items(self):
+        """Yields (domain, value) of all entries"""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for label, child in node.items():
+                if label is None:
+                    yield child
+                else:
+                    stack.append(child)
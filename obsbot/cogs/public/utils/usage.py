@@ -0,0 +1,63 @@
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+
+
+def hour_to_datetime(hour: int) -> datetime:
+    return datetime.fromtimestamp(hour * 3600, tz=timezone.utc)
+
+
+class UsageBuckets:
+    """
+    Per-hour usage counters for a recent window (e.g. the last 7 days) kept in memory,
+    plus the increments that have not been written to the database yet.
+    """
+
+    def __init__(self, window_hours=24 * 7):
+        self.window_hours = window_hours
+        # hour (since epoch) -> Counter(key -> uses)
+        self.hours = dict()
+        # running totals over all in-memory hours
+        self.totals = Counter()
+        # (key, hour) -> uses not yet flushed
+        self.pending = Counter()
+
+    @staticmethod
+    def current_hour(now=None) -> int:
+        return int((now or time.time()) // 3600)
+
+    def _add(self, key, hour, uses):
+        if hour not in self.hours:
+            self.hours[hour] = Counter()
+            self.prune(hour)
+        self.hours[hour][key] += uses
+        self.totals[key] += uses
+
+    def record(self, key, now=None):
+        hour = self.current_hour(now)
+        self._add(key, hour, 1)
+        self.pending[key, hour] += 1
+
+    def load(self, rows):
+        """Fill in-memory window from (key, hour, uses) rows, e.g. fetched from the database"""
+        oldest = self.current_hour() - self.window_hours
+        for key, hour, uses in rows:
+            if hour > oldest:
+                self._add(key, hour, uses)
+
+    def prune(self, current_hour):
+        for hour in [h for h in self.hours if h <= current_hour - self.window_hours]:
+            self.totals.subtract(self.hours.pop(hour))
+        self.totals = +self.totals
+
+    def take_pending(self) -> Counter:
+        """Returns and resets unflushed counts, use `restore` to put them back if writing them failed"""
+        pending, self.pending = self.pending, Counter()
+        return pending
+
+    def restore(self, pending):
+        self.pending.update(pending)
+
+    def recent(self, key) -> int:
+        return self.totals.get(key, 0)
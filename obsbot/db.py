@@ -32,6 +32,11 @@ class DBHelper:
         logger.debug(f'Fetching from DB with query "{query}" and args {args}, {kwargs}')
         return await self.conn.fetch(query, *args, **kwargs)
 
+    async def query_row(self, query, *args, **kwargs) -> Union[asyncpg.Record, None]:
+        """Execute query and return first row of results (e.g. for RETURNING clauses)"""
+        logger.debug(f'Fetching row from DB with query "{query}" and args {args}, {kwargs}')
+        return await self.conn.fetchrow(query, *args, **kwargs)
+
     async def exec(self, command, *args, **kwargs) -> Union[List[asyncpg.Record], None]:
         logger.debug(f'Sending DB execute "{command}" with args {args}, {kwargs}')
         return await self.conn.execute(command, *args, **kwargs)
@@ -40,6 +45,15 @@ class DBHelper:
         logger.debug(f'Sending DB multi-execute "{command}" with {len(arglist)} inputs')
         return await self.conn.executemany(command, arglist, **kwargs)
 
+    def acquire(self):
+        """Acquire a connection from the pool (async context manager), e.g. for transactions or COPY"""
+        return self.conn.acquire()
+
+    async def copy_from_query(self, query, *args, **kwargs):
+        """Run COPY for the results of query, see asyncpg's copy_from_query() for output/format options"""
+        logger.debug(f'Copying from DB with query "{query}" and args {args}')
+        return await self.conn.copy_from_query(query, *args, **kwargs)
+
     async def add_task(self, query, *args, **kwargs) -> asyncio.Task:
         """Create task that will execute async, can be optionally awaited by caller"""
         return asyncio.create_task(self.exec(query, *args, **kwargs))
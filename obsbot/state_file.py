@@ -14,6 +14,7 @@ class StateFile(MutableMapping):
 
     def __init__(self, filename):
         self._filename = filename
+        self._listeners = []
         self.store = dict()
 
         if os.path.exists(self._filename):
@@ -25,13 +26,21 @@ class StateFile(MutableMapping):
         return self.store[key]
 
     def __setitem__(self, key, value):
+        changed = self.store.get(key) != value
         self.store[key] = value
         json.dump(self.store, open(self._filename, 'w'), indent=2, sort_keys=True)
+        if changed:
+            for callback in self._listeners:
+                callback(key, value)
 
     def __delitem__(self, key):
         del self.store[key]
         json.dump(self.store, open(self._filename, 'w'), indent=2, sort_keys=True)
 
+    def add_listener(self, callback):
+        """Register callback(key, value) to be called whenever the value of a key changes"""
+        self._listeners.append(callback)
+
     def __iter__(self):
         return iter(self.store)
 
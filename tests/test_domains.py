@@ -0,0 +1,17 @@
+import time
+
+from obsbot.cogs.public.utils.domains import extract_hosts
+
+
+def test_extract_hosts():
+    text = 'claim at https://discord.com@Gift.Example.COM./x, dіscord-gift.com a..b.c v1.2 10.0.0.1 localhost.'
+    assert extract_hosts(text) == {'discord.com', 'gift.example.com', 'xn--dscord-gift-zvj.com', 'b.c'}
+    assert extract_hosts('no hosts in here') == set()
+
+
+def test_extract_hosts_adversarial_input_is_linear():
+    # a host regex with nested repetition backtracks quadratically on this, minutes for 100k characters
+    start = time.perf_counter()
+    assert extract_hosts('a-' * 50_000 + '.') == set()
+    assert extract_hosts(('a-' * 5_000 + '. ') * 10) == set()
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,27 @@
+import regex
+
+from obsbot.cogs.public.utils.filters import FILTER_FLAGS, ScopedFilterEngine
+from obsbot.cogs.public.utils.normalize import normalization_sensitive, normalize
+
+
+def test_normalize():
+    assert normalize('ｆｒｅｅ ｎｉ​ｔｒｏ') == 'free nitro'
+    assert normalize('dіscord') == 'discord'
+    assert normalize('plain ascii') == 'plain ascii'
+
+
+def test_normalization_sensitive():
+    for pattern in ('бесплатно', r'​', 'ﬁle', r'\p{Cyrillic}', r'[^\x00-\x7F]', r'[^a-z]+', r'\\[^a]'):
+        assert normalization_sensitive(pattern), pattern
+    for pattern in (r'free\s+nitro', r'[a-z^]', r'\[^a\]', r'https?://\S+'):
+        assert not normalization_sensitive(pattern), pattern
+
+
+def test_negated_class_matches_raw_message():
+    engine = ScopedFilterEngine()
+    pattern = r'[^\x00-\x7F]{5}'
+    engine.set('non-ascii', regex.compile(pattern, FILTER_FLAGS), raw=normalization_sensitive(pattern))
+    engine.prepare()
+    message = 'ｆｒｅｅ ｎｉｔｒｏ'
+    assert engine.search(normalize(message), raw=message) is not None
+    assert engine.search('free nitro', raw='free nitro') is None
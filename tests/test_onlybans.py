@@ -0,0 +1,89 @@
+import asyncio
+import types
+
+import regex
+
+from obsbot.cogs.public.onlybans import OnlyBans
+from obsbot.cogs.public.utils.filters import FILTER_FLAGS, FilterScope, FilterStats
+
+
+class State(dict):
+    def add_listener(self, callback):
+        pass
+
+
+class Context:
+    def __init__(self):
+        self.author = self.channel = None
+        self.sent = []
+
+    async def send(self, content=None, embed=None, embeds=None):
+        self.sent.append(embeds or [embed])
+
+
+def make_cog():
+    bot = types.SimpleNamespace(
+        state=State(),
+        get_cog=lambda name: None,
+        get_channel=lambda channel_id: None,
+        guilds=[],
+        loop=None,
+        is_admin=lambda author: True,
+        is_private=lambda channel: True,
+    )
+    return OnlyBans(bot, {'db_table': 'filters'})
+
+
+def add_filters(cog, count, shadow=False):
+    for idx in range(count):
+        name = f'{"shadow" if shadow else "filter"}-{idx:03}'
+        cog.filters[name] = regex.compile(
+            rf'(?:free|cheap)\s+(?:nitro|steam|gift){idx}\s*(?:https?://\S+)?', FILTER_FLAGS
+        )
+        cog.stats[name] = FilterStats()
+        cog.stats[name].record_cost(0.0004)
+        if shadow:
+            cog.shadow.add(name)
+        elif idx % 3 == 0:
+            cog.bannable.add(name)
+        if idx % 2:
+            cog.scopes[name] = FilterScope(channels=range(1000000000000000000, 1000000000000000003))
+
+
+def check_messages(messages):
+    for embeds in messages:
+        assert 1 <= len(embeds) <= 10
+        assert sum(len(embed) for embed in embeds) <= 6000
+        for embed in embeds:
+            assert len(embed.fields) <= 25
+            assert all(len(field.value) <= 1024 and len(field.name) <= 256 for field in embed.fields)
+
+
+def test_listfilters_stays_within_embed_limits():
+    cog = make_cog()
+    add_filters(cog, 60)
+    add_filters(cog, 20, shadow=True)
+    ctx = Context()
+    asyncio.run(cog.listfilters.callback(cog, ctx))
+
+    check_messages(ctx.sent)
+    listed = '\n'.join(field.value for embeds in ctx.sent for embed in embeds for field in embed.fields)
+    assert all(f'"{name}"' in listed for name in cog.filters)
+
+
+def test_shadow_digest_stays_within_embed_limits():
+    cog = make_cog()
+    add_filters(cog, 12, shadow=True)
+    for name in cog.shadow:
+        cog.shadow_hits[name] = 5
+        cog.shadow_samples[name] = [f'<#1234567890>: `{"x" * 100}` in "{"y" * 150}"'] * 3
+    cog.shadow_skipped = 3
+    posted = []
+    cog.modlog.post = posted.append
+    cog.shadow_digest._current_loop = 1
+    asyncio.run(cog.shadow_digest.coro(cog))
+
+    assert len(posted) > 1
+    check_messages([[embed] for embed in posted])
+    assert sum(len(embed.fields) for embed in posted) == 12
+    assert posted[-1].footer.text